@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Замеры производительности компонентов чат-бота
+
+Использование:
+    python benchmark.py quantization --vectors 50000
+    python benchmark.py llm --backends torch torch_int8 onnx
+    python benchmark.py embeddings --backends torch torch_int8 onnx onnx_int8
+    python benchmark.py chunking --megabytes 20
+    python benchmark.py stress --seconds 30 --readers 8
+"""
+
+import sys
+import time
+import shutil
+import random
+import argparse
+import resource
+import threading
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+
+# Корень проекта (config) и src (models) в PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parent / 'src'))
+
+import config
+
+
+def synthetic_embeddings(rows: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Нормализованные векторы с кластерной структурой, похожей на эмбеддинги текста"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(16, rows // 200), dim)).astype('float32')
+    vectors = centers[rng.integers(0, len(centers), rows)]
+    vectors += 0.6 * rng.standard_normal((rows, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors, dtype='float32')
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Доля точных top-k соседей, найденных индексом"""
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def bench_quantization(args):
+    """Память индекса и полнота поиска для разных вариантов квантования"""
+    import faiss
+    from models.vector_store import VectorStore
+
+    # Сравниваем квантование на точном (Flat) индексе
+    config.IVF_INDEX_THRESHOLD = 0
+    config.HNSW_INDEX_THRESHOLD = 0
+    config.VECTOR_STORE_COMPACTION_ROWS = args.vectors + 1
+
+    vectors = synthetic_embeddings(args.vectors, args.dim)
+    queries = synthetic_embeddings(args.queries, args.dim, seed=1)
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.top_k]
+    records = [{'text': '', 'filename': 'bench', 'chunk_id': i} for i in range(args.vectors)]
+
+    print(f"{args.vectors} векторов x {args.dim}, {args.queries} запросов, recall@{args.top_k}")
+    print(f"{'квантование':<12} {'индекс, МБ':>10} {'байт/вектор':>12} "
+          f"{'recall':>8} {'recall+rescore':>15} {'мс/запрос':>10}")
+
+    for quantization in ('none', 'sq8', 'pq'):
+        path = tempfile.mkdtemp(prefix='bench_vs_')
+        try:
+            store = VectorStore(path, quantization=quantization)
+            store.add(vectors, records)
+            if store._rebuild_thread is not None:
+                store._rebuild_thread.join()
+            # Новые векторы попадают в индекс при компактизации
+            store.compact()
+
+            index_bytes = faiss.serialize_index(store.index).nbytes
+            _, raw_ids = store.index.search(queries, args.top_k)
+
+            started = time.perf_counter()
+            _, ids = store.search(queries, args.top_k)
+            elapsed_ms = (time.perf_counter() - started) * 1000 / args.queries
+
+            print(f"{store.quantization:<12} {index_bytes / 2**20:>10.1f} {index_bytes / args.vectors:>12.0f} "
+                  f"{recall_at_k(raw_ids, truth):>8.3f} {recall_at_k(ids, truth):>15.3f} {elapsed_ms:>10.2f}")
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _llm_worker(model_name: str, backend: str, args, results):
+    """Замер одного бэкенда в отдельном процессе, чтобы RSS бэкендов не смешивался"""
+    import torch
+    from models.llm_backend import load_llm
+
+    started = time.perf_counter()
+    tokenizer, model, used = load_llm(model_name, backend)
+    load_seconds = time.perf_counter() - started
+
+    prompt = (
+        "Релевантная информация:\n- Доставка по Москве занимает один день.\n\n"
+        "Вопрос пользователя: сколько идет доставка?\nОтвет:"
+    )
+    input_ids = tokenizer([prompt] * args.batch, return_tensors='pt')
+    params = {
+        'max_new_tokens': args.tokens,
+        'min_new_tokens': args.tokens,
+        'do_sample': False,
+        'pad_token_id': tokenizer.eos_token_id
+    }
+
+    with torch.no_grad():
+        model.generate(**input_ids, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            model.generate(**input_ids, **params)
+        elapsed = time.perf_counter() - started
+
+    results.put({
+        'backend': used,
+        'load_seconds': load_seconds,
+        'tokens_per_second': args.runs * args.batch * args.tokens / elapsed,
+        # ru_maxrss в Linux - в килобайтах
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+
+
+def bench_llm(args):
+    """Скорость генерации и пиковая память для бэкендов языковой модели"""
+    context = multiprocessing.get_context('spawn')
+    print(f"{args.model}: {args.runs} x {args.batch} промптов по {args.tokens} новых токенов")
+    print(f"{'бэкенд':<12} {'загружен как':<13} {'загрузка, с':>12} {'токенов/с':>10} {'RSS, МБ':>9}")
+
+    for backend in args.backends:
+        results = context.Queue()
+        worker = context.Process(target=_llm_worker, args=(args.model, backend, args, results))
+        worker.start()
+        worker.join()
+        if worker.exitcode != 0:
+            print(f"{backend:<12} ошибка (код {worker.exitcode})")
+            continue
+
+        result = results.get()
+        print(f"{backend:<12} {result['backend']:<13} {result['load_seconds']:>12.1f} "
+              f"{result['tokens_per_second']:>10.1f} {result['rss_mb']:>9.0f}")
+
+
+def sample_texts(count: int, seed: int = 0) -> list:
+    """Тексты, похожие на чанки базы знаний (русские и английские предложения)"""
+    words = ("доставка заказ оплата возврат товар магазин склад курьер срок карта "
+             "delivery order payment refund product store warehouse courier card price").split()
+    rng = np.random.default_rng(seed)
+    return [' '.join(rng.choice(words, rng.integers(8, 60))) + '.' for _ in range(count)]
+
+
+def bench_embeddings(args):
+    """Скорость кодирования и совпадение эмбеддингов бэкендов с эталонным torch"""
+    from models.embedding_backend import load_embedding_model, embedding_parity
+
+    texts = sample_texts(args.texts)
+    reference = None
+    print(f"{args.model}: {args.texts} текстов, batch_size={args.batch_size}")
+    print(f"{'бэкенд':<12} {'загружен как':<13} {'текстов/с':>10} {'min cos':>8} {'mean cos':>9}")
+
+    for backend in ['torch'] + [b for b in args.backends if b != 'torch']:
+        model, used = load_embedding_model(args.model, backend)
+        model.encode(texts[:args.batch_size], batch_size=args.batch_size, show_progress_bar=False)
+
+        started = time.perf_counter()
+        embeddings = model.encode(texts, batch_size=args.batch_size, show_progress_bar=False, convert_to_numpy=True)
+        elapsed = time.perf_counter() - started
+
+        if reference is None:
+            reference = embeddings
+        parity = embedding_parity(embeddings, reference)
+        print(f"{backend:<12} {used:<13} {args.texts / elapsed:>10.1f} "
+              f"{parity['min_cosine']:>8.4f} {parity['mean_cosine']:>9.4f}")
+
+
+def synthetic_corpus(megabytes: float, seed: int = 0):
+    """Части (страницы) текста на русском и английском общим объемом около megabytes МБ"""
+    rng = np.random.default_rng(seed)
+    words = ("доставка заказа занимает один рабочий день по Москве и области оплата картой "
+             "или наличными курьеру возврат товара в течение 14 дней г. Москва ул. Ленина "
+             "delivery takes one business day payment by card or cash refund within days").split()
+    ends = ['.', '.', '.', '!', '?', '...']
+    size, target = 0, int(megabytes * 2**20)
+    while size < target:
+        sentences = []
+        for _ in range(rng.integers(5, 40)):
+            sentence = ' '.join(rng.choice(words, rng.integers(4, 30)))
+            sentences.append(sentence[0].upper() + sentence[1:] + rng.choice(ends))
+        page = ' '.join(sentences) + '\n\n'
+        size += len(page.encode('utf-8'))
+        yield page
+
+
+def legacy_chunks(text: str, max_chunk_size: int = 500) -> list:
+    """Прежнее разбиение: по '. ' с конкатенацией строк и размером в символах"""
+    chunks, current_chunk = [], ""
+    for sentence in text.split('. '):
+        if len(current_chunk) + len(sentence) <= max_chunk_size:
+            current_chunk += sentence + ". "
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = sentence + ". "
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def bench_chunking(args):
+    """Скорость разбиения большого корпуса и разброс длины чанков в токенах"""
+    from models.text_chunker import TextChunker, approximate_token_counts, tokenizer_token_counts
+
+    count_tokens = approximate_token_counts
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        count_tokens = tokenizer_token_counts(AutoTokenizer.from_pretrained(args.tokenizer))
+
+    pages = list(synthetic_corpus(args.megabytes))
+    megabytes = sum(len(page.encode('utf-8')) for page in pages) / 2**20
+    print(f"Корпус {megabytes:.1f} МБ, {len(pages)} страниц; чанк {args.chunk_tokens} токенов, "
+          f"перекрытие {args.overlap_tokens}")
+    print(f"{'разбиение':<10} {'МБ/с':>8} {'чанков':>8} {'токенов: сред':>14} {'стд':>6} {'макс':>6}")
+
+    def report(name, make_chunks):
+        started = time.perf_counter()
+        chunks = make_chunks()
+        elapsed = time.perf_counter() - started
+        tokens = np.array(approximate_token_counts(chunks) if count_tokens is approximate_token_counts
+                          else count_tokens(chunks))
+        print(f"{name:<10} {megabytes / elapsed:>8.2f} {len(chunks):>8} {tokens.mean():>14.1f} "
+              f"{tokens.std():>6.1f} {tokens.max():>6}")
+
+    chunker = TextChunker(args.chunk_tokens, args.overlap_tokens, count_tokens)
+    report('tokens', lambda: list(chunker.chunks(iter(pages))))
+    if not args.skip_legacy:
+        report('legacy', lambda: legacy_chunks(''.join(pages)))
+
+
+def _stress_readers(store, queries: np.ndarray, args, stop: threading.Event) -> dict:
+    """Поиск в нескольких потоках до события stop; задержки и нарушения согласованности"""
+    latencies, problems = [], []
+    lock = threading.Lock()
+
+    def reader(seed: int):
+        rng = np.random.default_rng(seed)
+        local_latencies, local_problems = [], []
+        while not stop.is_set():
+            query = queries[rng.integers(0, len(queries), args.batch)]
+            # Удаление, опубликованное до начала поиска, не должно попасть в результат
+            deleted_before = store.deleted
+            try:
+                started = time.perf_counter()
+                _, ids = store.search(query, args.top_k)
+                local_latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                local_problems.append(f"ошибка поиска: {e!r}")
+                continue
+
+            rows_after = store.rows
+            for row in ids:
+                row = row[row >= 0]
+                if len(np.unique(row)) != len(row):
+                    local_problems.append(f"повтор ID в результате: {row.tolist()}")
+                if len(row) and row.max() >= rows_after:
+                    local_problems.append(f"ID за пределами журнала: {int(row.max())} >= {rows_after}")
+                stale = np.intersect1d(row, deleted_before)
+                if len(stale):
+                    local_problems.append(f"удаленные ID в результате: {stale.tolist()}")
+                if len(row) and store.get_chunk(int(row[0])) is None and not store.is_deleted(int(row[0])):
+                    local_problems.append(f"нет записи чанка для ID {int(row[0])}")
+
+        with lock:
+            latencies.extend(local_latencies)
+            problems.extend(local_problems)
+
+    threads = [threading.Thread(target=reader, args=(seed,)) for seed in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    return {'threads': threads, 'latencies': latencies, 'problems': problems}
+
+
+def _stress_report(name: str, readers: dict, seconds: float) -> int:
+    """Печать задержек фазы; возвращает число нарушений"""
+    for thread in readers['threads']:
+        thread.join()
+    latencies = np.array(readers['latencies']) * 1000
+    if not len(latencies):
+        print(f"{name:<14} нет завершенных запросов")
+        return 1
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:<14} {len(latencies) / seconds:>10.0f} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} "
+          f"{latencies.max():>8.2f} {len(readers['problems']):>9}")
+    for problem in readers['problems'][:10]:
+        print(f"    {problem}")
+    return len(readers['problems'])
+
+
+def bench_stress(args):
+    """Поиск в нескольких потоках одновременно с добавлением, удалением и заменой документов
+
+    Завершается с кодом 1, если поиск нарушил согласованность или запись завершилась ошибкой.
+    """
+    from models.vector_store import VectorStore
+
+    config.VECTOR_STORE_COMPACTION_ROWS = args.compaction_rows
+    config.IVF_INDEX_THRESHOLD = args.ivf_threshold
+
+    chunks_per_doc = 20
+    vectors = synthetic_embeddings(args.vectors + args.seconds * 20000, args.dim)
+    queries = synthetic_embeddings(1000, args.dim, seed=1)
+    cursor = 0
+
+    def document(name: str):
+        nonlocal cursor
+        if cursor + chunks_per_doc > len(vectors):
+            cursor = 0
+        batch = vectors[cursor:cursor + chunks_per_doc]
+        cursor += chunks_per_doc
+        return batch, [{'text': f"{name} чанк {i}", 'filename': name, 'chunk_id': i}
+                       for i in range(chunks_per_doc)]
+
+    path = tempfile.mkdtemp(prefix='bench_stress_')
+    try:
+        store = VectorStore(path)
+        documents = [f"doc_{i}" for i in range(args.vectors // chunks_per_doc)]
+        for start in range(0, len(documents), 500):
+            batch = [document(name) for name in documents[start:start + 500]]
+            store.add(np.concatenate([b[0] for b in batch]), [r for b in batch for r in b[1]])
+        store.compact()
+        print(f"{store.ntotal} векторов x {args.dim}, {args.readers} потоков поиска по {args.batch} запросов, "
+              f"top_k={args.top_k}, {args.seconds} с на фазу")
+        print(f"{'фаза':<14} {'запрос/с':>10} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} "
+              f"{'макс, мс':>8} {'нарушений':>9}")
+
+        stop = threading.Event()
+        readers = _stress_readers(store, queries, args, stop)
+        time.sleep(args.seconds)
+        stop.set()
+        violations = _stress_report('только поиск', readers, args.seconds)
+
+        writes = {'add': 0, 'delete': 0, 'replace': 0, 'errors': []}
+
+        def writer(seed: int):
+            rng = random.Random(seed)
+            serial = 0
+            while not stop.is_set():
+                try:
+                    operation = rng.choice(('add', 'delete', 'replace'))
+                    if operation == 'add':
+                        name = f"new_{seed}_{serial}"
+                        serial += 1
+                        store.add(*document(name))
+                        documents.append(name)
+                    elif operation == 'delete' and documents:
+                        store.delete_document(documents.pop(rng.randrange(len(documents))))
+                    elif documents:
+                        name = rng.choice(documents)
+                        store.replace_document(name, *document(name))
+                    writes[operation] += 1
+                except Exception as e:
+                    writes['errors'].append(f"{operation}: {e!r}")
+
+        stop = threading.Event()
+        readers = _stress_readers(store, queries, args, stop)
+        writers = [threading.Thread(target=writer, args=(seed,)) for seed in range(args.writers)]
+        for thread in writers:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in writers:
+            thread.join()
+        violations += _stress_report('поиск+запись', readers, args.seconds)
+
+        for thread in (store._compaction_thread, store._rebuild_thread):
+            if thread is not None:
+                thread.join()
+        print(f"Записи: добавлено {writes['add']}, удалено {writes['delete']}, заменено {writes['replace']} "
+              f"документов, ошибок {len(writes['errors'])}")
+        for error in writes['errors'][:10]:
+            print(f"    {error}")
+        print(f"Индекс: {store.get_index_info()}")
+        store.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    if violations or writes['errors']:
+        print(f"ОШИБКА: нарушений {violations}, ошибок записи {len(writes['errors'])}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности чат-бота')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    quantization = subparsers.add_parser('quantization', help='Память и полнота квантованных индексов')
+    quantization.add_argument('--vectors', type=int, default=50000)
+    quantization.add_argument('--dim', type=int, default=384)
+    quantization.add_argument('--queries', type=int, default=200)
+    quantization.add_argument('--top-k', type=int, default=10)
+    quantization.set_defaults(func=bench_quantization)
+
+    llm = subparsers.add_parser('llm', help='Скорость и память бэкендов языковой модели')
+    llm.add_argument('--model', default=config.LLM_MODEL)
+    llm.add_argument('--backends', nargs='+', default=['torch', 'torch_int8', 'onnx'])
+    llm.add_argument('--tokens', type=int, default=64)
+    llm.add_argument('--batch', type=int, default=1)
+    llm.add_argument('--runs', type=int, default=3)
+    llm.set_defaults(func=bench_llm)
+
+    embeddings = subparsers.add_parser('embeddings', help='Скорость и точность бэкендов модели эмбеддингов')
+    embeddings.add_argument('--model', default=config.EMBEDDING_MODEL)
+    embeddings.add_argument('--backends', nargs='+', default=['torch', 'torch_int8', 'onnx', 'onnx_int8'])
+    embeddings.add_argument('--texts', type=int, default=1000)
+    embeddings.add_argument('--batch-size', type=int, default=config.EMBEDDING_BATCH_SIZE)
+    embeddings.set_defaults(func=bench_embeddings)
+
+    chunking = subparsers.add_parser('chunking', help='Разбиение большого корпуса на чанки')
+    chunking.add_argument('--megabytes', type=float, default=20)
+    chunking.add_argument('--chunk-tokens', type=int, default=config.CHUNK_SIZE_TOKENS)
+    chunking.add_argument('--overlap-tokens', type=int, default=config.CHUNK_OVERLAP_TOKENS)
+    chunking.add_argument('--tokenizer', default='', help='Токенизатор transformers (по умолчанию приближенный подсчет)')
+    chunking.add_argument('--skip-legacy', action='store_true', help='Не замерять прежнее разбиение')
+    chunking.set_defaults(func=bench_chunking)
+
+    stress = subparsers.add_parser('stress', help='Одновременные поиск и изменение векторного хранилища')
+    stress.add_argument('--vectors', type=int, default=50000)
+    stress.add_argument('--dim', type=int, default=384)
+    stress.add_argument('--seconds', type=int, default=10)
+    stress.add_argument('--readers', type=int, default=4)
+    stress.add_argument('--writers', type=int, default=2)
+    stress.add_argument('--batch', type=int, default=1, help='Запросов в одном поиске')
+    stress.add_argument('--top-k', type=int, default=10)
+    stress.add_argument('--compaction-rows', type=int, default=2000)
+    stress.add_argument('--ivf-threshold', type=int, default=config.IVF_INDEX_THRESHOLD)
+    stress.set_defaults(func=bench_stress)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
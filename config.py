@@ -15,6 +15,16 @@ for dir_path in [UPLOAD_DIR, VECTOR_STORE_DIR, LOGS_DIR]:
 # Модели ИИ
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
 LLM_MODEL = os.getenv('LLM_MODEL', 'distilgpt2')  # Используем более легкую модель
+# Бэкенд инференса языковой модели: torch, torch_int8 (динамическое int8 квантование)
+# или onnx (ONNX Runtime, требует optimum[onnxruntime]; экспорт кэшируется в ONNX_MODELS_PATH)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'torch')
+# Бэкенд модели эмбеддингов: torch, torch_int8, onnx или onnx_int8 (ONNX бэкенды требуют
+# optimum[onnxruntime]); экспортированные int8 графы кэшируются в ONNX_MODELS_PATH
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+ONNX_MODELS_PATH = str(BASE_DIR / 'onnx_models')
+# Проверка совместимости бэкенда, отличного от torch, с эталонным torch при загрузке:
+# минимально допустимое косинусное сходство на контрольных текстах
+EMBEDDING_PARITY_MIN_COSINE = float(os.getenv('EMBEDDING_PARITY_MIN_COSINE', '0.99'))
 
 # Flask конфигурация
 FLASK_ENV = os.getenv('FLASK_ENV', 'development')
@@ -36,8 +46,94 @@ TESSERACT_CMD = '/usr/bin/tesseract'  # Путь к tesseract в Linux
 MAX_CONTEXT_LENGTH = 512
 MAX_RESPONSE_LENGTH = 256
 TOP_K_DOCUMENTS = 5
+
+# Динамическое пакетирование генерации: максимум промптов в пакете и ожидание (мс)
+LLM_BATCH_MAX_SIZE = int(os.getenv('LLM_BATCH_MAX_SIZE', '8'))
+LLM_BATCH_WAIT_MS = float(os.getenv('LLM_BATCH_WAIT_MS', '20'))
 SIMILARITY_THRESHOLD = 0.7
 
+# Гибридный поиск: векторный + ключевой (BM25), списки объединяются через RRF
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', 'true').lower() == 'true'
+RRF_K = 60
+HYBRID_CANDIDATES = 20  # Кандидатов из каждого списка до объединения
+# Минимальная оценка BM25 ключевого кандидата, не прошедшего порог векторного сходства
+# (совпадение по одному частому слову не должно тянуть чанк в контекст)
+KEYWORD_MIN_SCORE = float(os.getenv('KEYWORD_MIN_SCORE', '5.0'))
+
+# Переранжирование кандидатов кросс-энкодером (пустое имя модели - отключено)
+RERANKER_MODEL = os.getenv('RERANKER_MODEL', '')
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '20'))
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '150'))  # Бюджет на весь поиск с переранжированием
+
+# Максимум запросов в одном вызове пакетного поиска
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_BATCH_MAX_QUERIES', '1000'))
+# Максимум результатов на один запрос поиска (top_k ограничивается этим значением)
+MAX_SEARCH_RESULTS = int(os.getenv('MAX_SEARCH_RESULTS', '50'))
+
+# Микро-пакетирование эмбеддингов конкурентных запросов: окно ожидания (мс) и размер пакета
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '5'))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '32'))
+
+# Размер LRU кэша эмбеддингов запросов
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '10000'))
+
+# Кэш ответов проекта: размер, время жизни (сек) и порог сходства почти совпадающих запросов
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.95'))
+
+# Контекст сессий в памяти: число сессий, бюджет (байт), время простоя до вытеснения (сек)
+# и число хранимых обменов. Вытесненные сессии сохраняются в таблицу chat_sessions
+SESSION_CACHE_MAX_SESSIONS = int(os.getenv('SESSION_CACHE_MAX_SESSIONS', '10000'))
+SESSION_CACHE_MAX_BYTES = int(os.getenv('SESSION_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+SESSION_TTL = int(os.getenv('SESSION_TTL', '1800'))
+SESSION_HISTORY_LENGTH = 10
+
+# Упаковка промпта в бюджет MAX_CONTEXT_LENGTH - MAX_RESPONSE_LENGTH токенов: число последних
+# обменов сессии в промпте и размер кэша длин текстов в токенах
+CONTEXT_HISTORY_EXCHANGES = 2
+CONTEXT_TOKEN_CACHE_SIZE = int(os.getenv('CONTEXT_TOKEN_CACHE_SIZE', '20000'))
+
+# Размер чанков базы знаний и перекрытие соседних чанков в токенах модели эмбеддингов
+CHUNK_SIZE_TOKENS = int(os.getenv('CHUNK_SIZE_TOKENS', '128'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '24'))
+
+# Отбрасывание точных и почти совпадающих чанков документа перед созданием эмбеддингов:
+# почти совпадающими считаются чанки, SimHash которых отличается не более чем в N битах из 64
+DEDUP_CHUNKS = os.getenv('DEDUP_CHUNKS', 'true').lower() == 'true'
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', '9'))
+
+# Постоянный кэш эмбеддингов чанков (ключ - хэш модели и текста): повторное обучение
+# не кодирует заново неизменившиеся тексты. При достижении лимита векторов кэш очищается
+EMBEDDING_CACHE = os.getenv('EMBEDDING_CACHE', 'true').lower() == 'true'
+EMBEDDING_CACHE_PATH = str(BASE_DIR / 'embedding_cache')
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', '500000'))
+
+# Размер пакета при создании эмбеддингов для базы знаний
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+
+# Число строк журнала и удалений, не учтенных в индексе, после которого запускается фоновая компактизация
+VECTOR_STORE_COMPACTION_ROWS = int(os.getenv('VECTOR_STORE_COMPACTION_ROWS', '10000'))
+
+# Доля удаленных векторов в индексе без поддержки удаления (HNSW), после которой он перестраивается
+TOMBSTONE_REBUILD_RATIO = float(os.getenv('TOMBSTONE_REBUILD_RATIO', '0.1'))
+
+# Приближенный поиск: пороги перехода с точного индекса (0 - не использовать)
+IVF_INDEX_THRESHOLD = int(os.getenv('IVF_INDEX_THRESHOLD', '50000'))
+HNSW_INDEX_THRESHOLD = int(os.getenv('HNSW_INDEX_THRESHOLD', '1000000'))
+ANN_TRAINING_SAMPLE = 100000  # Максимум векторов для обучения IVF
+HNSW_M = 32
+
+# Квантование векторов в индексе: none, sq8 (в 4 раза меньше) или pq (в 32 раза меньше)
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')
+# Байт на вектор для PQ; если размерность не делится, берется наибольший делитель меньше этого числа
+PQ_SUBQUANTIZERS = 48
+RESCORE_FACTOR = 4  # Во сколько раз больше кандидатов пересчитывается точно
+
+# Параметры поиска по умолчанию (переопределяются в настройках проекта)
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', '16'))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '64'))
+
 # Redis настройки (для кэширования)
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
@@ -49,4 +145,5 @@ RATE_LIMIT_DEFAULT = "100 per hour"
 RATE_LIMIT_CHAT = "10 per minute"
 
 # База данных
+PROJECTS_DB_PATH = str(BASE_DIR / 'projects.db')
 DATABASE_URL = os.getenv('DATABASE_URL', f'sqlite:///{BASE_DIR}/chatbot.db')
\ No newline at end of file
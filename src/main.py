@@ -21,7 +21,7 @@ from datetime import datetime
 import config
 from routes.chatbot import chatbot_bp
 from routes.projects import projects_bp
-from models.chatbot import ChatbotModel
+from models.model_registry import model_registry
 
 def create_app():
     """Создание и настройка Flask приложения"""
@@ -49,6 +49,10 @@ def create_app():
     app.register_blueprint(chatbot_bp, url_prefix='/api')
     app.register_blueprint(projects_bp, url_prefix='/api')
     
+    # Фоновая загрузка и прогрев моделей: приложение отвечает сразу,
+    # готовность видна в /api/status
+    model_registry.start_background_loading(config.EMBEDDING_MODEL, config.LLM_MODEL)
+    
     # Главная страница
     @app.route('/')
     def index():
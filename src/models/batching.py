@@ -0,0 +1,136 @@
+"""
+Пакетная обработка конкурентных запросов к моделям
+
+Потоки Flask сдают задания в очередь и ждут результат; рабочий поток
+собирает задания, пришедшие в пределах короткого окна, и выполняет их
+одним пакетным вызовом модели.
+"""
+
+import abc
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import List, Tuple, Any
+import logging
+
+import numpy as np
+import faiss
+import torch
+
+
+class MicroBatcher(abc.ABC):
+    """Базовый планировщик: очередь заданий и рабочий поток, обрабатывающий их пакетами"""
+
+    def __init__(self, window_ms: float, max_batch: int, name: str):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: 'queue.Queue[Tuple[Any, Future]]' = queue.Queue()
+
+        self._worker = threading.Thread(target=self._run, name=name)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def submit(self, item: Any) -> Any:
+        """Постановка задания в очередь и ожидание результата"""
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _collect_batch(self) -> List[Tuple[Any, Future]]:
+        """Первое задание ждем без ограничения, остальные - в пределах окна"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                results = self._process([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+            except Exception as e:
+                logging.error(f"Ошибка пакетной обработки ({self._worker.name}): {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+    @abc.abstractmethod
+    def _process(self, items: List[Any]) -> List[Any]:
+        """Обработка пакета заданий одним вызовом модели"""
+
+
+class EmbeddingBatcher(MicroBatcher):
+    """Микро-пакетирование эмбеддингов запросов"""
+
+    def __init__(self, embedding_model, window_ms: float, max_batch: int):
+        self.embedding_model = embedding_model
+        super().__init__(window_ms, max_batch, 'embedding-batcher')
+
+    def encode(self, text: str) -> np.ndarray:
+        """Нормализованный эмбеддинг одного текста (блокирует до готовности пакета)"""
+        return self.submit(text)
+
+    def _process(self, texts: List[str]) -> List[np.ndarray]:
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=len(texts),
+            show_progress_bar=False,
+            convert_to_numpy=True
+        )
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+
+        # Нормализация для косинусного сходства
+        faiss.normalize_L2(embeddings)
+        return list(embeddings)
+
+
+class GenerationBatcher(MicroBatcher):
+    """Динамическое пакетирование генерации языковой модели
+
+    Промпты пакета дополняются слева pad токенами до общей длины (модель
+    декодерная, продолжение должно начинаться сразу после промпта), и весь
+    пакет генерируется одним вызовом generate.
+    """
+
+    def __init__(self, tokenizer, llm_model, window_ms: float, max_batch: int, generation_kwargs: dict):
+        self.tokenizer = tokenizer
+        self.llm_model = llm_model
+        self.generation_kwargs = generation_kwargs
+        super().__init__(window_ms, max_batch, 'generation-batcher')
+
+    def generate(self, input_ids: List[int]) -> str:
+        """Продолжение промпта (блокирует до готовности пакета)"""
+        return self.submit(input_ids)
+
+    def _process(self, prompts: List[List[int]]) -> List[str]:
+        pad_id = self.tokenizer.pad_token_id
+        max_length = max(len(ids) for ids in prompts)
+
+        input_ids = torch.full((len(prompts), max_length), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompts), max_length), dtype=torch.long)
+        for row, ids in enumerate(prompts):
+            input_ids[row, max_length - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, max_length - len(ids):] = 1
+
+        device = self.llm_model.device
+        with torch.no_grad():
+            outputs = self.llm_model.generate(
+                input_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                **self.generation_kwargs
+            )
+
+        return [
+            self.tokenizer.decode(output[max_length:], skip_special_tokens=True).strip()
+            for output in outputs
+        ]
@@ -0,0 +1,274 @@
+"""
+Инвертированный индекс чанков для ключевого поиска (BM25)
+
+Дополняет векторный поиск точными совпадениями слов: артикулы, телефоны,
+коды товаров часто не находятся по эмбеддингам. Для каждого терма хранится
+список постингов (ID чанка, частота терма), ID совпадает с ID вектора.
+Индекс дописывается вместе с векторным хранилищем и сохраняется снимком
+при его компактизации; при загрузке снимок дополняется текстами из хвоста
+хранилища чанков. Удаленные чанки сразу перестают учитываться в статистике
+BM25 (число документов, средняя длина), а их постинги вычищаются перед
+сохранением снимка.
+"""
+
+import re
+import math
+import pickle
+import threading
+from array import array
+from collections import Counter
+from typing import List, Dict, Tuple, Iterable
+
+import numpy as np
+
+# Параметры BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+WORD_PATTERN = re.compile(r'\w+')
+# Коды из нескольких частей: SKU-123-45, A1.02/7
+CODE_PATTERN = re.compile(r'\w+(?:[-./]\w+)+')
+# Телефоны и номера с пробелами и скобками: +7 (495) 123-45-67
+PHONE_PATTERN = re.compile(r'\+?\d[\d\s()\-]{5,}\d')
+SEPARATORS = re.compile(r'[^\w]|_')
+
+
+# Номер телефона сравнивается по последним 10 цифрам (8 и +7 в начале равнозначны)
+PHONE_DIGITS = 10
+
+# Служебные слова и подписи к кодам, допустимые в запросе, состоящем из идентификатора
+IDENTIFIER_QUERY_STOPWORDS = frozenset({
+    'и', 'или', 'в', 'во', 'на', 'по', 'с', 'со', 'для', 'о', 'об', 'к', 'а', 'the', 'a', 'an', 'of', 'for',
+    'артикул', 'арт', 'код', 'номер', 'телефон', 'тел', 'sku', 'id', 'no', 'code', 'phone'
+})
+
+
+def _has_digit(term: str) -> bool:
+    return any(c.isdigit() for c in term)
+
+
+def _identifier(term: str) -> str:
+    """Терм-идентификатор из слова или пустая строка
+
+    Идентификатором считаются буквенно-цифровые коды и длинные числа;
+    короткие числа (годы, количества) слишком часто встречаются в обычных
+    вопросах.
+    """
+    if term.isdigit():
+        return term[-PHONE_DIGITS:] if len(term) >= 5 else ''
+    return term if len(term) >= 3 and _has_digit(term) else ''
+
+
+def code_terms(text: str) -> List[str]:
+    """Термы-идентификаторы текста: коды с цифрами, составные коды и номера без разделителей"""
+    text = text.lower()
+    terms = [_identifier(w) for w in WORD_PATTERN.findall(text)]
+    for match in CODE_PATTERN.findall(text):
+        if _has_digit(match):
+            terms.append(_identifier(SEPARATORS.sub('', match)))
+    for match in PHONE_PATTERN.findall(text):
+        terms.append(_identifier(re.sub(r'\D', '', match)))
+    return [term for term in dict.fromkeys(terms) if term]
+
+
+def is_identifier_query(text: str) -> bool:
+    """Запрос по сути состоит из идентификаторов: кроме кодов в нем только служебные слова"""
+    text = text.lower()
+    rest = PHONE_PATTERN.sub(' ', text)
+    rest = CODE_PATTERN.sub(lambda m: ' ' if _has_digit(m.group(0)) else m.group(0), rest)
+    for word in WORD_PATTERN.findall(rest):
+        if not _identifier(word) and word not in IDENTIFIER_QUERY_STOPWORDS:
+            return False
+    return bool(code_terms(text))
+
+
+def tokenize(text: str) -> List[str]:
+    """Термы текста: слова в нижнем регистре и термы-идентификаторы"""
+    return WORD_PATTERN.findall(text.lower()) + code_terms(text)
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Объединение ранжированных списков ID: сумма 1 / (k + ранг) по спискам"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            scores[idx] = scores.get(idx, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """Инвертированный индекс с ранжированием BM25, строка = ID вектора"""
+
+    def __init__(self):
+        # Число строк (следующий ID), число живых документов и их суммарная длина
+        self.rows = 0
+        self.live_rows = 0
+        self.total_length = 0
+        self.doc_lengths = array('i')
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        # Удаленные ID (отсортированы) исключаются из результатов
+        self.deleted = np.empty(0, dtype=np.int64)
+        # Есть ли удаленные ID, постинги которых еще не вычищены
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def add(self, texts: Iterable[str]):
+        """Добавление текстов чанков со следующими по порядку ID
+
+        Тексты токенизируются до взятия блокировки, поэтому поиск ждет
+        только вставку постингов.
+        """
+        documents = []
+        for text in texts:
+            terms = tokenize(text)
+            documents.append((len(terms), Counter(terms)))
+
+        with self._lock:
+            for length, counts in documents:
+                row = self.rows
+                for term, tf in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array('i'), array('i'))
+                    postings[0].append(row)
+                    postings[1].append(tf)
+
+                self.doc_lengths.append(length)
+                self.total_length += length
+                self.rows += 1
+                self.live_rows += 1
+
+    def remove(self, rows: np.ndarray):
+        """Исключение чанков из поиска и из статистики BM25"""
+        with self._lock:
+            rows = np.setdiff1d(np.asarray(rows, dtype=np.int64), self.deleted)
+            rows = rows[(rows >= 0) & (rows < self.rows)]
+            if len(rows) == 0:
+                return
+            self.deleted = np.union1d(self.deleted, rows)
+            self.total_length -= int(np.frombuffer(self.doc_lengths, dtype=np.int32)[rows].sum())
+            self.live_rows -= len(rows)
+            self._dirty = True
+
+    def purge(self):
+        """Удаление постингов удаленных чанков (перед сохранением снимка)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            for term, (rows, tf) in list(self._postings.items()):
+                term_rows = np.frombuffer(rows, dtype=np.int32)
+                live = ~np.isin(term_rows, self.deleted)
+                if live.all():
+                    continue
+                if not live.any():
+                    del self._postings[term]
+                    continue
+                live_rows, live_tf = array('i'), array('i')
+                live_rows.frombytes(term_rows[live].tobytes())
+                live_tf.frombytes(np.frombuffer(tf, dtype=np.int32)[live].tobytes())
+                del term_rows
+                self._postings[term] = (live_rows, live_tf)
+            self._dirty = False
+
+    def _score(self, terms: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """ID чанков с термами запроса и их оценки BM25 (вызывается под блокировкой)
+
+        Представления постингов через np.frombuffer не выходят за пределы
+        метода: пока они живы, массивы array нельзя дописывать.
+        """
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.int32)
+        avg_length = max(self.total_length / max(self.live_rows, 1), 1.0)
+
+        all_rows, all_scores = [], []
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            rows = np.frombuffer(postings[0], dtype=np.int32)
+            tf = np.frombuffer(postings[1], dtype=np.int32).astype(np.float32)
+            if self._dirty:
+                # Частота терма считается только по живым документам
+                live = ~np.isin(rows, self.deleted)
+                rows, tf = rows[live], tf[live]
+                if len(rows) == 0:
+                    continue
+            idf = math.log(1 + (self.live_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[rows] / avg_length)
+            all_rows.append(rows.astype(np.int64))
+            all_scores.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+
+        if not all_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        return rows, scores
+
+    def search(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Лучшие по BM25 чанки: (оценки, ID) по убыванию оценки"""
+        with self._lock:
+            if self.live_rows == 0:
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+            rows, scores = self._score(tokenize(query))
+
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        return scores[order], rows[order]
+
+    def exact_match(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Чанки, содержащие все термы-идентификаторы запроса (пусто, если их нет в запросе)"""
+        terms = code_terms(query)
+        if not terms:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        with self._lock:
+            if any(term not in self._postings for term in terms):
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+            matched = None
+            for term in terms:
+                rows = np.array(self._postings[term][0], dtype=np.int64)
+                matched = rows if matched is None else np.intersect1d(matched, rows, assume_unique=True)
+
+            # Среди точных совпадений порядок задает BM25 по всему запросу
+            rows, scores = self._score(tokenize(query))
+
+        keep = np.isin(rows, matched)
+        rows, scores = rows[keep], scores[keep]
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        return scores[order], rows[order]
+
+    def save(self, path: str):
+        """Сохранение снимка индекса"""
+        with self._lock:
+            data = pickle.dumps({
+                'rows': self.rows,
+                'live_rows': self.live_rows,
+                'total_length': self.total_length,
+                'deleted': self.deleted,
+                'dirty': self._dirty,
+                'doc_lengths': self.doc_lengths,
+                'postings': self._postings
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        """Загрузка снимка индекса"""
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+
+        index = cls()
+        index.rows = data['rows']
+        # Снимки прежнего формата не хранят удаления: они применяются заново через remove
+        index.live_rows = data.get('live_rows', data['rows'])
+        index.deleted = data.get('deleted', index.deleted)
+        index._dirty = data.get('dirty', False)
+        index.total_length = data['total_length']
+        index.doc_lengths = data['doc_lengths']
+        index._postings = data['postings']
+        return index
@@ -0,0 +1,170 @@
+"""
+Кэши для ускорения поиска и генерации ответов
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, List
+
+import numpy as np
+
+import config
+
+
+def normalize_query(text: str) -> str:
+    """Нормализация текста запроса для ключа кэша"""
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class QueryEmbeddingCache:
+    """Потокобезопасный LRU кэш: нормализованный запрос -> нормализованный эмбеддинг"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[Tuple[str, str], np.ndarray]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_name: str, query: str) -> Optional[np.ndarray]:
+        """Эмбеддинг запроса из кэша или None"""
+        key = (model_name, normalize_query(query))
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, model_name: str, query: str, embedding: np.ndarray):
+        """Сохранение эмбеддинга запроса (копия только для чтения)"""
+        if self.max_size <= 0:
+            return
+        embedding = np.array(embedding, dtype='float32')
+        embedding.setflags(write=False)
+
+        key = (model_name, normalize_query(query))
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Очистка кэша"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, float]:
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+
+class AnswerCache:
+    """Кэш ответов проекта по точному и почти совпадающему запросу
+
+    Запись хранит нормализованный эмбеддинг запроса: при отсутствии точного
+    совпадения ищется запрос с косинусным сходством не ниже порога. Записи
+    живут не дольше ttl секунд, при переполнении вытесняются самые старые
+    по использованию. Кэш сбрасывается при изменении базы знаний; ответ,
+    посчитанный до сброса, в кэш уже не попадает (проверка поколения).
+    """
+
+    def __init__(self, max_size: int, ttl: float, similarity_threshold: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: 'OrderedDict[str, Tuple[np.ndarray, str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str, query_embedding: np.ndarray) -> Optional[str]:
+        """Ответ на тот же или почти такой же запрос, если он есть в кэше"""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                key = self._find_similar(query_embedding)
+                entry = self._entries.get(key) if key is not None else None
+
+            if entry is None or now - entry[2] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _find_similar(self, query_embedding: np.ndarray) -> Optional[str]:
+        """Ключ наиболее похожего запроса со сходством не ниже порога"""
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[k][0] for k in self._matrix_keys])
+
+        similarities = self._matrix @ query_embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return self._matrix_keys[best]
+        return None
+
+    def put(self, query: str, query_embedding: np.ndarray, answer: str, generation: int):
+        """Сохранение ответа, посчитанного при поколении кэша generation"""
+        if self.max_size <= 0:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (np.asarray(query_embedding, dtype='float32'), answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        self._matrix = None
+
+    def clear(self):
+        """Сброс кэша (после изменения базы знаний)"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.generation += 1
+
+    def get_stats(self) -> Dict[str, float]:
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+
+# Общий кэш эмбеддингов запросов процесса (ключ включает имя модели)
+query_embedding_cache = QueryEmbeddingCache(config.QUERY_EMBEDDING_CACHE_SIZE)
@@ -2,119 +2,147 @@
 Основная модель чат-бота с поддержкой RAG (Retrieval-Augmented Generation)
 """
 
-import os
-import json
-import pickle
+import time
+import threading
 import numpy as np
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Union
 import logging
 
 import torch
-from transformers import (
-    AutoTokenizer, AutoModel, 
-    AutoModelForCausalLM, 
-    pipeline
-)
-from sentence_transformers import SentenceTransformer
 import faiss
-from sklearn.metrics.pairwise import cosine_similarity
+from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
 
 import config
+from models.model_registry import model_registry, generation_kwargs, STATE_READY
+from models.vector_store import VectorStore
+from models.bm25_index import reciprocal_rank_fusion, is_identifier_query
+from models.cache import query_embedding_cache, AnswerCache
+from models.session_store import SessionStore
+from models.context_packer import ContextPacker
+from models.text_chunker import TextChunker, tokenizer_token_counts, approximate_token_counts
+from models.dedup import ChunkDeduplicator
+
+class _StopOnEvent(StoppingCriteria):
+    """Остановка генерации по событию (клиент закрыл потоковое соединение)"""
+    
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
 
 class ChatbotModel:
-    """Основная модель чат-бота с поддержкой RAG"""
+    """Основная модель чат-бота с поддержкой RAG
     
-    def __init__(self):
+    Веса моделей берутся из общего реестра процесса, экземпляр хранит только
+    состояние проекта: векторное хранилище, документы и сессии. Хранилище
+    открывается по явному пути (по умолчанию общее config.VECTOR_STORE_PATH),
+    поэтому у каждого проекта своя независимая база знаний. Параметры поиска
+    и квантование проекта передаются хранилищу при открытии, до проверки,
+    нужна ли перестройка индекса.
+    """
+    
+    def __init__(self, vector_store_path: Optional[str] = None, session_store: Optional[SessionStore] = None,
+                 search_params: Optional[Dict[str, int]] = None, quantization: Optional[str] = None):
         self.embedding_model = None
+        self.embedding_batcher = None
         self.llm_model = None
         self.llm_tokenizer = None
+        self.generation_batcher = None
+        self.reranker = None
+        self.context_packer = None
+        self.text_chunker = None
+        self.embedding_cache = None
         self.vector_store = None
-        self.document_store = {}
-        self.index_to_doc_mapping = {}
-        self.session_contexts = {}
+        self.vector_store_path = vector_store_path or config.VECTOR_STORE_PATH
+        self.search_params = search_params
+        self.quantization = quantization
+        self.session_store = session_store or SessionStore(config.PROJECTS_DB_PATH)
+        self.answer_cache = AnswerCache(
+            config.ANSWER_CACHE_SIZE,
+            config.ANSWER_CACHE_TTL,
+            config.ANSWER_CACHE_SIMILARITY
+        )
         self.initialized = False
         self.last_update = None
         
-        # Инициализация при создании экземпляра
-        self._initialize_models()
+        # Модели загружаются в фоне, векторное хранилище читается сразу
+        model_registry.start_background_loading(config.EMBEDDING_MODEL, config.LLM_MODEL)
+        if config.RERANKER_MODEL:
+            self.reranker = model_registry.get_reranker(config.RERANKER_MODEL)
+        self._initialize_vector_store()
     
-    def _initialize_models(self):
-        """Инициализация ИИ моделей"""
-        try:
-            logging.info("Загрузка модели эмбеддингов...")
-            self.embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
-            
-            logging.info("Загрузка языковой модели...")
-            self.llm_tokenizer = AutoTokenizer.from_pretrained(config.LLM_MODEL)
-            self.llm_model = AutoModelForCausalLM.from_pretrained(
-                config.LLM_MODEL,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map="auto" if torch.cuda.is_available() else None
-            )
-            
-            # Добавляем pad_token если его нет
-            if self.llm_tokenizer.pad_token is None:
-                self.llm_tokenizer.pad_token = self.llm_tokenizer.eos_token
-            
-            # Инициализация векторного хранилища
-            self._initialize_vector_store()
-            
-            self.initialized = True
-            logging.info("Модели успешно инициализированы")
-            
-        except Exception as e:
-            logging.error(f"Ошибка инициализации моделей: {e}")
-            raise
+    def _bind_models(self):
+        """Привязка общих моделей из реестра после их загрузки"""
+        self.embedding_model = model_registry.get_embedding_model(config.EMBEDDING_MODEL)
+        self.embedding_batcher = model_registry.get_embedding_batcher(config.EMBEDDING_MODEL)
+        self.llm_tokenizer, self.llm_model = model_registry.get_llm(config.LLM_MODEL)
+        self.generation_batcher = model_registry.get_generation_batcher(config.LLM_MODEL)
+        self.context_packer = ContextPacker(
+            self.llm_tokenizer,
+            config.MAX_CONTEXT_LENGTH - config.MAX_RESPONSE_LENGTH,
+            config.CONTEXT_TOKEN_CACHE_SIZE,
+            config.CONTEXT_HISTORY_EXCHANGES
+        )
+        if config.EMBEDDING_CACHE:
+            self.embedding_cache = model_registry.get_embedding_cache(config.EMBEDDING_MODEL)
+        tokenizer = getattr(self.embedding_model, 'tokenizer', None)
+        self.text_chunker = TextChunker(
+            config.CHUNK_SIZE_TOKENS,
+            config.CHUNK_OVERLAP_TOKENS,
+            tokenizer_token_counts(tokenizer) if tokenizer is not None else approximate_token_counts
+        )
+        self.initialized = True
     
     def _initialize_vector_store(self):
         """Инициализация или загрузка векторного хранилища"""
-        vector_store_path = os.path.join(config.VECTOR_STORE_PATH, 'faiss_index.bin')
-        document_store_path = os.path.join(config.VECTOR_STORE_PATH, 'document_store.pkl')
-        mapping_path = os.path.join(config.VECTOR_STORE_PATH, 'index_mapping.pkl')
-        
         try:
-            if os.path.exists(vector_store_path):
-                # Загрузка существующего хранилища
-                self.vector_store = faiss.read_index(vector_store_path)
-                
-                with open(document_store_path, 'rb') as f:
-                    self.document_store = pickle.load(f)
-                
-                with open(mapping_path, 'rb') as f:
-                    self.index_to_doc_mapping = pickle.load(f)
-                
-                logging.info(f"Загружено векторное хранилище: {self.vector_store.ntotal} документов")
-            else:
-                # Создание нового хранилища
-                embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
-                self.vector_store = faiss.IndexFlatIP(embedding_dim)  # Inner Product для косинусного сходства
-                logging.info("Создано новое векторное хранилище")
-                
+            self.vector_store = VectorStore(self.vector_store_path, self.search_params, self.quantization)
         except Exception as e:
             logging.error(f"Ошибка инициализации векторного хранилища: {e}")
-            # Создание нового хранилища в случае ошибки
-            embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
-            self.vector_store = faiss.IndexFlatIP(embedding_dim)
+            raise
     
     def is_initialized(self) -> bool:
         """Проверка инициализации моделей"""
+        if not self.initialized and self.get_loading_state() == STATE_READY:
+            self._bind_models()
         return self.initialized
     
+    def get_loading_state(self) -> str:
+        """Состояние загрузки моделей: loading, warming, ready или error"""
+        return model_registry.get_state(config.EMBEDDING_MODEL, config.LLM_MODEL)
+    
+    def wait_until_initialized(self, timeout: Optional[float] = None):
+        """Ожидание загрузки моделей (для фоновых задач, которым нужны модели)"""
+        if not self.initialized:
+            if not model_registry.wait_until_ready(config.EMBEDDING_MODEL, config.LLM_MODEL, timeout):
+                error = model_registry.get_error(config.EMBEDDING_MODEL, config.LLM_MODEL)
+                raise RuntimeError(f"Модели не загружены: {error or self.get_loading_state()}")
+            self._bind_models()
+    
     def generate_response(self, message: str, session_id: str) -> str:
         """Генерация ответа на основе сообщения пользователя"""
         try:
-            if not self.initialized:
+            if not self.is_initialized():
                 return "Система инициализируется, попробуйте позже."
             
-            # Поиск релевантных документов
-            relevant_docs = self.search_knowledge_base(message, config.TOP_K_DOCUMENTS)
-            
-            # Формирование контекста
-            context = self._build_context(relevant_docs, message, session_id)
+            # Повторный или почти такой же вопрос отвечается из кэша
+            query_embedding = self._encode_query(message)
+            response = self.answer_cache.get(message, query_embedding)
             
-            # Генерация ответа
-            response = self._generate_llm_response(context, message)
+            if response is None:
+                generation = self.answer_cache.generation
+                
+                # Поиск релевантных документов
+                relevant_docs = self.search_knowledge_base(message, config.TOP_K_DOCUMENTS)
+                
+                # Формирование контекста
+                context = self._build_context(relevant_docs, message, session_id)
+                
+                # Генерация ответа
+                response = self._generate_llm_response(context, message)
+                self.answer_cache.put(message, query_embedding, response, generation)
             
             # Обновление контекста сессии
             self._update_session_context(session_id, message, response)
@@ -125,96 +153,205 @@ class ChatbotModel:
             logging.error(f"Ошибка генерации ответа: {e}")
             return "Извините, произошла ошибка при обработке вашего запроса."
     
+    def generate_response_stream(self, message: str, session_id: str) -> Iterator[Dict[str, str]]:
+        """Потоковая генерация ответа
+        
+        Выдает события {'event': 'token', 'text': ...} по мере генерации токенов
+        и в конце {'event': 'done', 'response': ...} с итоговым ответом. Итоговый
+        ответ может отличаться от склеенных фрагментов, если модель ничего
+        осмысленного не сгенерировала и сработал простой ответ.
+        """
+        if not self.is_initialized():
+            yield {'event': 'done', 'response': "Система инициализируется, попробуйте позже."}
+            return
+        
+        try:
+            query_embedding = self._encode_query(message)
+            response = self.answer_cache.get(message, query_embedding)
+            
+            if response is not None:
+                yield {'event': 'token', 'text': response}
+            else:
+                generation = self.answer_cache.generation
+                relevant_docs = self.search_knowledge_base(message, config.TOP_K_DOCUMENTS)
+                context = self._build_context(relevant_docs, message, session_id)
+                
+                parts = []
+                for text in self._stream_llm_response(context):
+                    parts.append(text)
+                    yield {'event': 'token', 'text': text}
+                
+                response = ''.join(parts).strip()
+                if len(response) < 10:
+                    response = self._generate_simple_response(message)
+                self.answer_cache.put(message, query_embedding, response, generation)
+            
+            self._update_session_context(session_id, message, response)
+            yield {'event': 'done', 'response': response}
+            
+        except Exception as e:
+            logging.error(f"Ошибка потоковой генерации ответа: {e}")
+            yield {'event': 'done', 'response': "Извините, произошла ошибка при обработке вашего запроса."}
+    
     def search_knowledge_base(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Поиск релевантных документов в базе знаний"""
+        """Поиск релевантных документов в базе знаний (см. search_many)"""
+        return self.search_many([query], top_k)[0]
+    
+    def search_many(self, queries: List[str], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Поиск по набору запросов, результаты в порядке запросов
+        
+        Векторный и ключевой (BM25) списки кандидатов объединяются через
+        reciprocal rank fusion; ключевые кандидаты без векторного сходства выше
+        порога берутся только с оценкой BM25 не ниже KEYWORD_MIN_SCORE. Запросы,
+        состоящие только из артикулов, телефонов и кодов, найденных в базе
+        дословно, обслуживаются инвертированным индексом без вызова модели
+        эмбеддингов. В остальных запросах дословные совпадения кодов идут в
+        объединение отдельным списком, а сами запросы кодируются пакетами и
+        ищутся в векторном хранилище одним вызовом. Если включено
+        переранжирование, лучшие кандидаты каждого запроса переупорядочиваются
+        кросс-энкодером в пределах бюджета времени на поиск. Оценка similarity
+        есть только у кандидатов, найденных векторным поиском.
+        """
+        results: List[List[Dict[str, Any]]] = [[] for _ in queries]
         try:
-            if self.vector_store is None or self.vector_store.ntotal == 0:
-                return []
+            started = time.perf_counter()
+            
+            if self.vector_store.ntotal == 0 or not queries:
+                return results
+            
+            keyword_index = self.vector_store.keyword_index
+            pending = []
+            for i, query in enumerate(queries):
+                if config.HYBRID_SEARCH and is_identifier_query(query):
+                    keyword_scores, keyword_ids = keyword_index.exact_match(query, top_k)
+                    if len(keyword_ids):
+                        keyword = dict(zip(keyword_ids.tolist(), keyword_scores.tolist()))
+                        results[i] = self._collect_results(list(keyword), {}, keyword)
+                        continue
+                pending.append(i)
             
-            # Создание эмбеддинга запроса
-            query_embedding = self.embedding_model.encode([query])
-            query_embedding = query_embedding.astype('float32')
+            if not pending or not self.is_initialized():
+                return results
             
-            # Нормализация для косинусного сходства
-            faiss.normalize_L2(query_embedding)
+            rerank_candidates = max(top_k, config.RERANK_CANDIDATES) if self.reranker is not None else top_k
+            candidates = max(rerank_candidates, config.HYBRID_CANDIDATES) if config.HYBRID_SEARCH else rerank_candidates
             
-            # Поиск в векторном хранилище
-            scores, indices = self.vector_store.search(query_embedding, min(top_k, self.vector_store.ntotal))
+            # Эмбеддинги запросов (из кэша для повторяющихся запросов) и один поиск по всей матрице
+            query_embeddings = self._encode_queries([queries[i] for i in pending])
+            scores, indices = self.vector_store.search(query_embeddings, candidates)
             
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx in self.index_to_doc_mapping and score > config.SIMILARITY_THRESHOLD:
-                    doc_id = self.index_to_doc_mapping[idx]
-                    if doc_id in self.document_store:
-                        doc_data = self.document_store[doc_id]
-                        results.append({
-                            'text': doc_data['text'],
-                            'filename': doc_data.get('filename', 'Unknown'),
-                            'similarity': float(score),
-                            'chunk_id': doc_data.get('chunk_id', 0)
-                        })
+            # Общая часть работы делится поровну между запросами пакета
+            shared_seconds = (time.perf_counter() - started) / len(pending)
+            
+            for row, i in enumerate(pending):
+                query_started = time.perf_counter()
+                dense = {
+                    int(idx): float(score)
+                    for score, idx in zip(scores[row], indices[row])
+                    if idx >= 0 and score > config.SIMILARITY_THRESHOLD
+                }
+                
+                if config.HYBRID_SEARCH:
+                    keyword_scores, keyword_ids = keyword_index.search(queries[i], candidates)
+                    # Ключевой кандидат проходит, если он релевантен и по вектору, или совпадение сильное
+                    keyword = {
+                        idx: score
+                        for idx, score in zip(keyword_ids.tolist(), keyword_scores.tolist())
+                        if idx in dense or score >= config.KEYWORD_MIN_SCORE
+                    }
+                    # Чанки с дословными кодами из запроса проходят без порога
+                    exact_scores, exact_ids = keyword_index.exact_match(queries[i], candidates)
+                    exact = dict(zip(exact_ids.tolist(), exact_scores.tolist()))
+                    keyword.update(exact)
+                    ranked = [
+                        idx for idx, _ in
+                        reciprocal_rank_fusion([list(dense), list(keyword), list(exact)], config.RRF_K)
+                    ]
+                else:
+                    keyword = {}
+                    ranked = list(dense)
+                
+                found = self._collect_results(ranked[:rerank_candidates], dense, keyword)
+                
+                if self.reranker is not None:
+                    elapsed = shared_seconds + time.perf_counter() - query_started
+                    reranked = self.reranker.rerank(queries[i], found, top_k, config.RERANK_BUDGET_MS / 1000 - elapsed)
+                    if reranked is not None:
+                        found = reranked
+                
+                results[i] = found[:top_k]
             
             return results
             
         except Exception as e:
             logging.error(f"Ошибка поиска в базе знаний: {e}")
-            return []
+            return results
     
-    def _build_context(self, relevant_docs: List[Dict[str, Any]], query: str, session_id: str) -> str:
-        """Формирование контекста для генерации ответа"""
-        context_parts = []
+    def _collect_results(self, ids: List[int], dense: Dict[int, float],
+                         keyword: Dict[int, float]) -> List[Dict[str, Any]]:
+        """Записи найденных чанков с оценками векторного и ключевого поиска"""
+        results = []
+        for idx in ids:
+            doc_data = self.vector_store.get_chunk(idx)
+            if doc_data is not None:
+                result = {
+                    'text': doc_data['text'],
+                    'filename': doc_data.get('filename', 'Unknown'),
+                    'keyword_score': keyword.get(idx),
+                    'chunk_id': doc_data.get('chunk_id', 0)
+                }
+                # У кандидатов только из ключевого поиска векторного сходства нет
+                if idx in dense:
+                    result['similarity'] = dense[idx]
+                results.append(result)
+        return results
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Нормализованный эмбеддинг запроса с использованием LRU кэша"""
+        embedding = query_embedding_cache.get(config.EMBEDDING_MODEL, query)
+        if embedding is not None:
+            return embedding
+        
+        # Конкурентные запросы кодируются общим пакетом
+        embedding = self.embedding_batcher.encode(query)
         
-        # Добавление релевантных документов
-        if relevant_docs:
-            context_parts.append("Релевантная информация:")
-            for doc in relevant_docs[:3]:  # Используем только топ-3 документа
-                context_parts.append(f"- {doc['text'][:200]}...")
+        query_embedding_cache.put(config.EMBEDDING_MODEL, query, embedding)
+        return embedding
+    
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Матрица нормализованных эмбеддингов запросов (промахи кэша кодируются пакетами)"""
+        if len(queries) == 1:
+            return self._encode_query(queries[0]).reshape(1, -1)
         
-        # Добавление истории сессии (последние 2 сообщения)
-        if session_id in self.session_contexts:
-            recent_context = self.session_contexts[session_id][-2:]
-            if recent_context:
-                context_parts.append("\nПредыдущий контекст:")
-                for ctx in recent_context:
-                    context_parts.append(f"Пользователь: {ctx['user']}")
-                    context_parts.append(f"Бот: {ctx['bot']}")
+        embeddings: List[Optional[np.ndarray]] = [
+            query_embedding_cache.get(config.EMBEDDING_MODEL, query) for query in queries
+        ]
+        misses = list({queries[i]: None for i, e in enumerate(embeddings) if e is None})
+        if misses:
+            encoded = self._encode_chunks(misses)
+            computed = dict(zip(misses, encoded))
+            for query, embedding in computed.items():
+                query_embedding_cache.put(config.EMBEDDING_MODEL, query, embedding)
+            embeddings = [e if e is not None else computed[q] for q, e in zip(queries, embeddings)]
         
-        context_parts.append(f"\nВопрос пользователя: {query}")
-        context_parts.append("Ответ:")
+        return np.ascontiguousarray(np.stack(embeddings), dtype='float32')
+    
+    def _build_context(self, relevant_docs: List[Dict[str, Any]], query: str, session_id: str) -> str:
+        """Формирование контекста для генерации ответа в пределах бюджета токенов
         
-        return "\n".join(context_parts)
+        Вопрос попадает в контекст всегда, затем документы в порядке
+        релевантности (не поместившийся целиком - первыми предложениями),
+        затем последние обмены сессии.
+        """
+        return self.context_packer.pack(query, relevant_docs, self.session_store.get(session_id))
     
     def _generate_llm_response(self, context: str, query: str) -> str:
         """Генерация ответа с помощью языковой модели"""
         try:
-            # Ограничение длины контекста
-            max_context_length = config.MAX_CONTEXT_LENGTH - config.MAX_RESPONSE_LENGTH
-            
-            # Токенизация контекста
-            inputs = self.llm_tokenizer.encode(
-                context, 
-                truncation=True, 
-                max_length=max_context_length,
-                return_tensors='pt'
-            )
-            
-            # Генерация ответа
-            with torch.no_grad():
-                outputs = self.llm_model.generate(
-                    inputs,
-                    max_new_tokens=config.MAX_RESPONSE_LENGTH,
-                    do_sample=True,
-                    temperature=0.7,
-                    top_p=0.9,
-                    pad_token_id=self.llm_tokenizer.eos_token_id,
-                    eos_token_id=self.llm_tokenizer.eos_token_id
-                )
+            input_ids = self._encode_prompt(context)
             
-            # Декодирование ответа
-            response = self.llm_tokenizer.decode(
-                outputs[0][len(inputs[0]):], 
-                skip_special_tokens=True
-            ).strip()
+            # Генерация ответа вместе с другими ожидающими запросами одним пакетом
+            response = self.generation_batcher.generate(input_ids)
             
             # Если модель не сгенерировала ответ, используем простую логику
             if not response or len(response) < 10:
@@ -226,6 +363,52 @@ class ChatbotModel:
             logging.error(f"Ошибка генерации LLM ответа: {e}")
             return self._generate_simple_response(query)
     
+    def _encode_prompt(self, context: str) -> List[int]:
+        """Токенизация контекста с ограничением длины (контекст уже упакован в бюджет)"""
+        max_context_length = config.MAX_CONTEXT_LENGTH - config.MAX_RESPONSE_LENGTH
+        return self.llm_tokenizer.encode(
+            context, 
+            truncation=True, 
+            max_length=max_context_length
+        )
+    
+    def _stream_llm_response(self, context: str) -> Iterator[str]:
+        """Фрагменты ответа языковой модели по мере генерации
+        
+        Потоковый запрос генерируется отдельно от пакетного планировщика:
+        первый токен отдается сразу, не дожидаясь окна и соседей по пакету.
+        """
+        input_ids = torch.tensor([self._encode_prompt(context)], dtype=torch.long)
+        streamer = TextIteratorStreamer(self.llm_tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop = threading.Event()
+        
+        def run():
+            try:
+                with torch.no_grad():
+                    self.llm_model.generate(
+                        input_ids.to(self.llm_model.device),
+                        attention_mask=torch.ones_like(input_ids).to(self.llm_model.device),
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop)]),
+                        **generation_kwargs(self.llm_tokenizer)
+                    )
+            except Exception as e:
+                logging.error(f"Ошибка потоковой генерации LLM ответа: {e}")
+                streamer.end()
+        
+        thread = threading.Thread(target=run, name='llm-stream')
+        thread.daemon = True
+        thread.start()
+        
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            # При досрочном закрытии генератора модель перестает генерировать
+            stop.set()
+            thread.join()
+    
     def _generate_simple_response(self, query: str) -> str:
         """Простая генерация ответа на основе ключевых слов"""
         query_lower = query.lower()
@@ -249,102 +432,121 @@ class ChatbotModel:
         return "Я понял ваш вопрос, но не смог найти точную информацию в базе знаний. Попробуйте переформулировать вопрос или загрузить дополнительные документы."
     
     def _update_session_context(self, session_id: str, user_message: str, bot_response: str):
-        """Обновление контекста сессии"""
-        if session_id not in self.session_contexts:
-            self.session_contexts[session_id] = []
-        
-        self.session_contexts[session_id].append({
-            'user': user_message,
-            'bot': bot_response,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        # Ограничение размера контекста (последние 10 обменов)
-        if len(self.session_contexts[session_id]) > 10:
-            self.session_contexts[session_id] = self.session_contexts[session_id][-10:]
+        """Обновление контекста сессии (хранится последние SESSION_HISTORY_LENGTH обменов)"""
+        self.session_store.append(session_id, user_message, bot_response)
     
-    def update_knowledge_base(self, text: str, filename: str):
-        """Обновление базы знаний новым документом"""
+    def update_knowledge_base(self, text: Union[str, Iterable[str]], filename: str,
+                              replace: bool = False) -> Dict[str, Any]:
+        """Обновление базы знаний новым документом (replace - заменить прежние чанки документа)
+        
+        text - строка или итератор последовательных частей текста документа.
+        """
         try:
+            self.wait_until_initialized()
+            
             # Разбиение текста на чанки
             chunks = self._split_text_into_chunks(text)
             
-            for i, chunk in enumerate(chunks):
-                # Создание эмбеддинга
-                embedding = self.embedding_model.encode([chunk])
-                embedding = embedding.astype('float32')
-                
-                # Нормализация для косинусного сходства
-                faiss.normalize_L2(embedding)
-                
-                # Добавление в векторное хранилище
-                current_index = self.vector_store.ntotal
-                self.vector_store.add(embedding)
-                
-                # Создание уникального ID документа
-                doc_id = f"{filename}_{i}"
-                
-                # Сохранение документа
-                self.document_store[doc_id] = {
-                    'text': chunk,
-                    'filename': filename,
-                    'chunk_id': i,
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                # Маппинг индекса на документ
-                self.index_to_doc_mapping[current_index] = doc_id
+            # Повторяющиеся чанки (шапки, меню, баннеры страниц) не кодируются и не индексируются
+            duplicates_dropped = 0
+            if config.DEDUP_CHUNKS:
+                chunks, duplicates_dropped = ChunkDeduplicator(config.DEDUP_MAX_DISTANCE).filter(chunks)
+            
+            # Эмбеддинги из постоянного кэша, остальные - пакетно одним вызовом модели
+            started = time.perf_counter()
+            embeddings, embeddings_cached = self._encode_chunks_cached(chunks)
+            embedding_seconds = time.perf_counter() - started
             
-            # Сохранение обновленного хранилища
-            self._save_vector_store()
+            timestamp = datetime.now().isoformat()
+            records = [{
+                'text': chunk,
+                'filename': filename,
+                'chunk_id': i,
+                'timestamp': timestamp
+            } for i, chunk in enumerate(chunks)]
+            
+            # Массовое добавление; на диск дописываются только новые векторы и записи
+            chunks_removed = 0
+            if replace:
+                _, chunks_removed = self.vector_store.replace_document(filename, embeddings, records)
+            else:
+                self.vector_store.add(embeddings, records)
+            
+            # Ответы, построенные на прежней базе знаний, больше не актуальны
+            self.answer_cache.clear()
             self.last_update = datetime.now()
             
-            logging.info(f"Добавлено {len(chunks)} чанков из документа {filename}")
+            chunks_per_second = len(chunks) / embedding_seconds if embedding_seconds > 0 else 0.0
+            logging.info(
+                f"Добавлено {len(chunks)} чанков из документа {filename} (из кэша {embeddings_cached}), "
+                f"отброшено повторов {duplicates_dropped} "
+                f"({chunks_per_second:.1f} чанков/с, batch_size={config.EMBEDDING_BATCH_SIZE})"
+            )
+            
+            return {
+                'chunks_added': len(chunks),
+                'chunks_removed': chunks_removed,
+                'duplicates_dropped': duplicates_dropped,
+                'embeddings_cached': embeddings_cached,
+                'embedding_seconds': round(embedding_seconds, 3),
+                'chunks_per_second': round(chunks_per_second, 1),
+                'batch_size': config.EMBEDDING_BATCH_SIZE
+            }
             
         except Exception as e:
             logging.error(f"Ошибка обновления базы знаний: {e}")
             raise
     
-    def _split_text_into_chunks(self, text: str, max_chunk_size: int = 500) -> List[str]:
-        """Разбиение текста на чанки для лучшего поиска"""
-        # Простое разбиение по предложениям
-        sentences = text.split('. ')
-        chunks = []
-        current_chunk = ""
+    def replace_document(self, text: Union[str, Iterable[str]], filename: str) -> Dict[str, Any]:
+        """Замена документа в базе знаний новой версией"""
+        return self.update_knowledge_base(text, filename, replace=True)
+    
+    def delete_document(self, filename: str) -> int:
+        """Удаление документа из базы знаний; возвращает число удаленных чанков"""
+        removed = self.vector_store.delete_document(filename)
+        if removed:
+            self.answer_cache.clear()
+            self.last_update = datetime.now()
+            logging.info(f"Удалено {removed} чанков документа {filename}")
+        return removed
+    
+    def _encode_chunks(self, chunks: List[str]) -> np.ndarray:
+        """Пакетное кодирование чанков в нормализованные эмбеддинги"""
+        if not chunks:
+            dim = self.embedding_model.get_sentence_embedding_dimension()
+            return np.empty((0, dim), dtype='float32')
         
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= max_chunk_size:
-                current_chunk += sentence + ". "
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + ". "
+        embeddings = self.embedding_model.encode(
+            chunks,
+            batch_size=config.EMBEDDING_BATCH_SIZE,
+            show_progress_bar=False,
+            convert_to_numpy=True
+        )
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
         
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        # Нормализация для косинусного сходства
+        faiss.normalize_L2(embeddings)
+        return embeddings
+    
+    def _encode_chunks_cached(self, chunks: List[str]) -> tuple:
+        """Эмбеддинги чанков с использованием постоянного кэша; возвращает (эмбеддинги, число из кэша)"""
+        if self.embedding_cache is None or not chunks:
+            return self._encode_chunks(chunks), 0
+        
+        embeddings, found = self.embedding_cache.get_many(chunks)
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            computed = self._encode_chunks([chunks[i] for i in missing])
+            self.embedding_cache.put_many([chunks[i] for i in missing], computed)
+            if embeddings is None:
+                return computed, 0
+            embeddings[missing] = computed
         
-        return chunks
+        return embeddings, len(chunks) - len(missing)
     
-    def _save_vector_store(self):
-        """Сохранение векторного хранилища"""
-        try:
-            vector_store_path = os.path.join(config.VECTOR_STORE_PATH, 'faiss_index.bin')
-            document_store_path = os.path.join(config.VECTOR_STORE_PATH, 'document_store.pkl')
-            mapping_path = os.path.join(config.VECTOR_STORE_PATH, 'index_mapping.pkl')
-            
-            # Сохранение FAISS индекса
-            faiss.write_index(self.vector_store, vector_store_path)
-            
-            # Сохранение хранилища документов
-            with open(document_store_path, 'wb') as f:
-                pickle.dump(self.document_store, f)
-            
-            # Сохранение маппинга
-            with open(mapping_path, 'wb') as f:
-                pickle.dump(self.index_to_doc_mapping, f)
-                
-        except Exception as e:
-            logging.error(f"Ошибка сохранения векторного хранилища: {e}")
+    def _split_text_into_chunks(self, text: Union[str, Iterable[str]]) -> List[str]:
+        """Разбиение текста на чанки по предложениям в пределах бюджета токенов"""
+        return list(self.text_chunker.chunks(text))
     
     def get_vector_store_size(self) -> int:
         """Получение размера векторного хранилища"""
@@ -352,10 +554,7 @@ class ChatbotModel:
     
     def get_document_list(self) -> List[str]:
         """Получение списка документов в базе знаний"""
-        filenames = set()
-        for doc_data in self.document_store.values():
-            filenames.add(doc_data.get('filename', 'Unknown'))
-        return list(filenames)
+        return self.vector_store.get_filenames()
     
     def get_last_update_time(self) -> Optional[str]:
         """Получение времени последнего обновления"""
@@ -0,0 +1,175 @@
+"""
+Компактное хранилище текстов чанков на диске
+
+Формат:
+    chunks_text.bin  - тексты всех чанков подряд (UTF-8)
+    chunks_meta.bin  - массив записей фиксированного размера (смещение и длина
+                       текста, номер файла, номер чанка, время добавления)
+    chunk_files.txt  - имена файлов-источников, по одному в строке
+
+Оба бинарных файла только дописываются и отображаются в память, поэтому
+в RAM проекта не держатся Python объекты для каждого чанка. ID вектора
+совпадает с номером строки в массиве записей, текст читается только для
+запрошенных строк.
+"""
+
+import os
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+TEXT_FILE = 'chunks_text.bin'
+META_FILE = 'chunks_meta.bin'
+FILES_FILE = 'chunk_files.txt'
+
+META_DTYPE = np.dtype([
+    ('offset', '<i8'),
+    ('length', '<i4'),
+    ('file', '<i4'),
+    ('chunk', '<i4'),
+    ('timestamp', '<f8')
+])
+
+
+class ChunkStore:
+    """Хранилище чанков, строка массива записей = ID вектора"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.filenames: List[str] = []
+        self._file_ids: Dict[str, int] = {}
+        self.meta = np.empty(0, dtype=META_DTYPE)
+        self._text = np.empty(0, dtype=np.uint8)
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        """Открытие файлов хранилища с отбрасыванием недописанного хвоста"""
+        if os.path.exists(self._file(FILES_FILE)):
+            with open(self._file(FILES_FILE), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        self._register_filename(line[:-1])
+
+        meta_path = self._file(META_FILE)
+        rows = os.path.getsize(meta_path) // META_DTYPE.itemsize if os.path.exists(meta_path) else 0
+        self.truncate(rows)
+
+    def _remap(self):
+        """Повторное отображение файлов в память после изменения их размера
+
+        Тексты отображаются раньше записей: читатель без блокировки, увидевший
+        новую запись, уже увидит и ее текст.
+        """
+        text_path = self._file(TEXT_FILE)
+        text_size = os.path.getsize(text_path) if os.path.exists(text_path) else 0
+        if text_size:
+            self._text = np.memmap(text_path, dtype=np.uint8, mode='r', shape=(text_size,))
+        else:
+            self._text = np.empty(0, dtype=np.uint8)
+
+        meta_path = self._file(META_FILE)
+        rows = os.path.getsize(meta_path) // META_DTYPE.itemsize if os.path.exists(meta_path) else 0
+        if rows:
+            self.meta = np.memmap(meta_path, dtype=META_DTYPE, mode='r', shape=(rows,))
+        else:
+            self.meta = np.empty(0, dtype=META_DTYPE)
+
+    def _register_filename(self, filename: str) -> int:
+        if filename not in self._file_ids:
+            self._file_ids[filename] = len(self.filenames)
+            self.filenames.append(filename)
+        return self._file_ids[filename]
+
+    def truncate(self, rows: int):
+        """Обрезка хранилища до заданного числа строк"""
+        meta_path = self._file(META_FILE)
+        text_path = self._file(TEXT_FILE)
+
+        text_end = 0
+        if rows and os.path.exists(meta_path):
+            last = np.fromfile(meta_path, dtype=META_DTYPE, count=1, offset=(rows - 1) * META_DTYPE.itemsize)[0]
+            text_end = int(last['offset']) + int(last['length'])
+
+        for path, size in ((meta_path, rows * META_DTYPE.itemsize), (text_path, text_end)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+        self._remap()
+
+    def append(self, records: List[Dict[str, Any]]):
+        """Дописывание записей чанков (text, filename, chunk_id, timestamp)"""
+        if not records:
+            return
+
+        new_files = [r.get('filename', 'Unknown') for r in records
+                     if r.get('filename', 'Unknown') not in self._file_ids]
+        if new_files:
+            with open(self._file(FILES_FILE), 'a', encoding='utf-8') as f:
+                for filename in dict.fromkeys(new_files):
+                    self._register_filename(filename)
+                    f.write(filename + '\n')
+
+        text_path = self._file(TEXT_FILE)
+        offset = os.path.getsize(text_path) if os.path.exists(text_path) else 0
+        meta = np.empty(len(records), dtype=META_DTYPE)
+        blobs = []
+        for i, record in enumerate(records):
+            blob = record['text'].encode('utf-8')
+            timestamp = record.get('timestamp')
+            meta[i] = (
+                offset,
+                len(blob),
+                self._file_ids[record.get('filename', 'Unknown')],
+                record.get('chunk_id', 0),
+                datetime.fromisoformat(timestamp).timestamp() if timestamp else 0.0
+            )
+            offset += len(blob)
+            blobs.append(blob)
+
+        # Сначала тексты, затем записи: запись без текста не может появиться
+        with open(text_path, 'ab') as f:
+            f.write(b''.join(blobs))
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(self._file(META_FILE), 'ab') as f:
+            f.write(meta.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._remap()
+
+    def rows_of(self, filename: str) -> np.ndarray:
+        """Номера строк всех чанков файла"""
+        file_id = self._file_ids.get(filename)
+        if file_id is None:
+            return np.empty(0, dtype='int64')
+        return np.nonzero(self.meta['file'] == file_id)[0].astype('int64')
+
+    def get_text(self, row: int) -> str:
+        """Текст чанка по номеру строки"""
+        entry = self.meta[row]
+        start = int(entry['offset'])
+        return self._text[start:start + int(entry['length'])].tobytes().decode('utf-8')
+
+    def get(self, row: int) -> Optional[Dict[str, Any]]:
+        """Запись чанка по номеру строки"""
+        if not 0 <= row < len(self.meta):
+            return None
+        entry = self.meta[row]
+        return {
+            'text': self.get_text(row),
+            'filename': self.filenames[int(entry['file'])],
+            'chunk_id': int(entry['chunk']),
+            'timestamp': datetime.fromtimestamp(float(entry['timestamp'])).isoformat() if entry['timestamp'] else None
+        }
@@ -0,0 +1,166 @@
+"""
+Упаковка контекста промпта в бюджет токенов языковой модели
+
+Промпт собирается в порядке: релевантные фрагменты, история сессии,
+вопрос. Бюджет заполняется по приоритету: сначала вопрос, затем
+фрагменты в порядке релевантности, затем последние обмены сессии.
+Фрагмент, который не помещается целиком, обрезается по границе
+предложения. Число токенов фрагментов кэшируется, поэтому повторно
+попадающие в контекст чанки не токенизируются заново; вопросы, история
+и собранный промпт уникальны и считаются без кэша.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+')
+
+DOCS_HEADER = "Релевантная информация:"
+HISTORY_HEADER = "\nПредыдущий контекст:"
+ANSWER_LINE = "Ответ:"
+
+# Фрагмент короче этого числа токенов не стоит места в промпте
+MIN_FRAGMENT_TOKENS = 16
+
+
+class ContextPacker:
+    """Сборка промпта, помещающегося в заданное число токенов"""
+
+    def __init__(self, tokenizer, budget: int, cache_size: int, max_history: int):
+        self.tokenizer = tokenizer
+        self.budget = budget
+        self.cache_size = cache_size
+        self.max_history = max_history
+        self._counts: 'OrderedDict[str, int]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Перевод строки между частями промпта и неизменные служебные строки
+        self.separator_tokens = self.count("\n")
+        self.docs_header_cost = self._line_cost(DOCS_HEADER)
+        self.history_header_cost = self._line_cost(HISTORY_HEADER)
+        self.answer_cost = self._line_cost(ANSWER_LINE)
+        self.packed = 0
+        self.total_tokens = 0
+
+    def count(self, text: str) -> int:
+        """Число токенов текста"""
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def count_fragment(self, text: str) -> int:
+        """Число токенов строки фрагмента базы знаний (с кэшированием)"""
+        with self._lock:
+            count = self._counts.get(text)
+            if count is not None:
+                self._counts.move_to_end(text)
+                return count
+
+        count = self.count(text)
+        with self._lock:
+            self._counts[text] = count
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def _line_cost(self, line: str) -> int:
+        return self.count(line) + self.separator_tokens
+
+    def _fragment_cost(self, line: str) -> int:
+        return self.count_fragment(line) + self.separator_tokens
+
+    def pack(self, query: str, docs: List[Dict[str, Any]], history: List[Dict[str, Any]]) -> str:
+        """Промпт из вопроса, фрагментов (лучшие первыми) и истории сессии"""
+        question_line = self._fit_question(query)
+        remaining = self.budget - self._line_cost(question_line) - self.answer_cost
+
+        doc_lines: List[str] = []
+        for doc in docs:
+            header = self.docs_header_cost if not doc_lines else 0
+            fitted = self._fit_fragment(doc['text'], remaining - header)
+            if fitted is not None:
+                line, cost = fitted
+                doc_lines.append(line)
+                remaining -= header + cost
+
+        history_lines: List[str] = []
+        for exchange in reversed(history[-self.max_history:] if self.max_history else []):
+            lines = [f"Пользователь: {exchange['user']}", f"Бот: {exchange['bot']}"]
+            cost = sum(self._line_cost(line) for line in lines)
+            cost += self.history_header_cost if not history_lines else 0
+            if cost > remaining:
+                break
+            history_lines = lines + history_lines
+            remaining -= cost
+
+        # Сумма по частям может разойтись с токенизацией целого промпта на стыках,
+        # поэтому итог проверяется, а при превышении отбрасываются наименее важные части
+        while True:
+            prompt = self._assemble(doc_lines, history_lines, question_line)
+            tokens = self.count(prompt)
+            if tokens <= self.budget or not (doc_lines or history_lines):
+                break
+            if history_lines:
+                history_lines = history_lines[2:]
+            else:
+                doc_lines.pop()
+
+        with self._lock:
+            self.packed += 1
+            self.total_tokens += tokens
+        return prompt
+
+    def _assemble(self, doc_lines: List[str], history_lines: List[str], question_line: str) -> str:
+        parts = []
+        if doc_lines:
+            parts.append(DOCS_HEADER)
+            parts.extend(doc_lines)
+        if history_lines:
+            parts.append(HISTORY_HEADER)
+            parts.extend(history_lines)
+        parts.append(question_line)
+        parts.append(ANSWER_LINE)
+        return "\n".join(parts)
+
+    def _fit_question(self, query: str) -> str:
+        """Строка вопроса; слишком длинный вопрос обрезается, чтобы осталось место для ответа"""
+        line = f"\nВопрос пользователя: {query}"
+        limit = self.budget - self.answer_cost
+        if self._line_cost(line) <= limit:
+            return line
+
+        ids = self.tokenizer.encode(line, add_special_tokens=False)[:max(limit - self.separator_tokens, 0)]
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def _fit_fragment(self, text: str, budget: int) -> Optional[Tuple[str, int]]:
+        """Строка фрагмента в пределах бюджета (целиком или первые целые предложения) и ее стоимость"""
+        line = f"- {text}"
+        cost = self._fragment_cost(line)
+        if cost <= budget:
+            return line, cost
+        if budget < MIN_FRAGMENT_TOKENS:
+            return None
+
+        # Обрезанные варианты зависят от остатка бюджета, их в кэш не кладем
+        sentences = SENTENCE_BOUNDARY.split(text)
+        best = None
+        for end in range(1, len(sentences)):
+            candidate = f"- {' '.join(sentences[:end])}"
+            candidate_cost = self._line_cost(candidate)
+            if candidate_cost > budget:
+                break
+            best = candidate, candidate_cost
+
+        if best is None or best[1] - self.separator_tokens < MIN_FRAGMENT_TOKENS:
+            return None
+        return best
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Средний размер промпта и заполнение кэша счетчиков токенов"""
+        with self._lock:
+            return {
+                'budget': self.budget,
+                'prompts_packed': self.packed,
+                'avg_prompt_tokens': round(self.total_tokens / self.packed, 1) if self.packed else 0.0,
+                'cached_token_counts': len(self._counts)
+            }
@@ -0,0 +1,110 @@
+"""
+Отбрасывание повторяющихся чанков перед созданием эмбеддингов
+
+Собранные скрапером страницы повторяют шапку, подвал, меню и баннеры,
+и без отбора их чанки кодируются и индексируются многократно. Точные
+повторы определяются по хэшу нормализованного текста (регистр и
+пунктуация не учитываются), почти совпадающие - по SimHash слов-шинглов:
+чанки, отпечатки которых отличаются не более чем в max_distance битах из
+64, считаются дубликатами. Отпечаток делится на BANDS полос; у дубликата
+хотя бы одна полоса отличается не более чем в max_distance // BANDS битах,
+поэтому кандидаты ищутся по ключам полос в этом радиусе, и сравнение не
+квадратично.
+"""
+
+import re
+import hashlib
+from itertools import combinations
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r'\w+')
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+BANDS = 5
+# Ширина полос: 13, 13, 13, 13, 12 бит
+BAND_WIDTHS = [SIMHASH_BITS // BANDS + (band < SIMHASH_BITS % BANDS) for band in range(BANDS)]
+BAND_SHIFTS = [sum(BAND_WIDTHS[:band]) for band in range(BANDS)]
+
+_BIT_POSITIONS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+_SIMHASH_WEIGHTS = np.uint64(1) << _BIT_POSITIONS
+
+
+def _shingle_hashes(words: List[str]) -> np.ndarray:
+    """Независимые 64-битные хэши шинглов (стабильны между процессами, в отличие от hash())"""
+    if len(words) < SHINGLE_SIZE:
+        shingles = words
+    else:
+        shingles = [' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+
+    digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+    return np.frombuffer(digests, dtype=np.uint64)
+
+
+def simhash(words: List[str]) -> int:
+    """64-битный SimHash последовательности слов"""
+    hashes = _shingle_hashes(words)
+    if len(hashes) == 0:
+        return 0
+    bits = (hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(hashes)
+    return int(_SIMHASH_WEIGHTS[votes > 0].sum())
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _flip_masks(width: int, radius: int) -> List[int]:
+    """Маски, меняющие не более radius бит из width"""
+    return [sum(1 << bit for bit in bits)
+            for count in range(radius + 1) for bits in combinations(range(width), count)]
+
+
+class ChunkDeduplicator:
+    """Отбор первых вхождений среди точных и почти совпадающих чанков"""
+
+    def __init__(self, max_distance: int = 9):
+        if not 0 <= max_distance < SIMHASH_BITS:
+            raise ValueError(f"max_distance должно быть от 0 до {SIMHASH_BITS - 1}")
+        self.max_distance = max_distance
+        self._exact: set = set()
+        self._fingerprints: List[int] = []
+        self._bands: Dict[Tuple[int, int], List[int]] = {}
+        radius = max_distance // BANDS
+        self._masks = [_flip_masks(width, radius) for width in BAND_WIDTHS]
+
+    def is_duplicate(self, text: str) -> bool:
+        """Повторяет ли текст уже встреченный; новый текст запоминается"""
+        words = WORD_PATTERN.findall(text.lower())
+        digest = hashlib.blake2b(' '.join(words).encode('utf-8'), digest_size=16).digest()
+        if digest in self._exact:
+            return True
+        self._exact.add(digest)
+
+        fingerprint = simhash(words)
+        bands = [(band, (fingerprint >> shift) & ((1 << width) - 1))
+                 for band, (shift, width) in enumerate(zip(BAND_SHIFTS, BAND_WIDTHS))]
+        if self.max_distance:
+            checked = set()
+            for (band, value), masks in zip(bands, self._masks):
+                for mask in masks:
+                    for position in self._bands.get((band, value ^ mask), ()):
+                        if position in checked:
+                            continue
+                        checked.add(position)
+                        if _hamming(fingerprint, self._fingerprints[position]) <= self.max_distance:
+                            return True
+
+        position = len(self._fingerprints)
+        self._fingerprints.append(fingerprint)
+        for key in bands:
+            self._bands.setdefault(key, []).append(position)
+        return False
+
+    def filter(self, chunks: List[str]) -> Tuple[List[str], int]:
+        """Чанки без повторов (в исходном порядке) и число отброшенных"""
+        kept = [chunk for chunk in chunks if not self.is_duplicate(chunk)]
+        return kept, len(chunks) - len(kept)
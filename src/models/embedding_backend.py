@@ -0,0 +1,137 @@
+"""
+Бэкенды инференса модели эмбеддингов на CPU
+
+torch       - SentenceTransformer на PyTorch, как раньше
+torch_int8  - динамическое int8 квантование линейных слоев (torch.quantization)
+onnx        - граф ONNX Runtime (sentence-transformers backend="onnx", требует optimum[onnxruntime])
+onnx_int8   - граф ONNX Runtime с int8 весами; квантованный граф экспортируется
+              один раз в ONNX_MODELS_DIR
+
+Все бэкенды возвращают объект SentenceTransformer, поэтому encode и
+get_sentence_embedding_dimension работают одинаково. Векторы хранилища,
+посчитанные бэкендом torch, остаются пригодными, пока эмбеддинги другого
+бэкенда совпадают с ними по косинусу - это проверяет check_backend_parity
+на наборе контрольных текстов.
+"""
+
+import os
+from typing import Tuple, Dict
+import logging
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+import config
+
+BACKEND_TORCH = 'torch'
+BACKEND_TORCH_INT8 = 'torch_int8'
+BACKEND_ONNX = 'onnx'
+BACKEND_ONNX_INT8 = 'onnx_int8'
+BACKENDS = (BACKEND_TORCH, BACKEND_TORCH_INT8, BACKEND_ONNX, BACKEND_ONNX_INT8)
+
+# Конфигурация квантования ONNX (набор инструкций CPU) и имя получаемого файла
+ONNX_QUANTIZATION = 'avx2'
+ONNX_INT8_FILE = f'onnx/model_qint8_{ONNX_QUANTIZATION}.onnx'
+
+# Контрольные тексты для сравнения бэкенда с эталонным torch
+PARITY_TEXTS = [
+    "Доставка по Москве занимает один рабочий день.",
+    "Оплатить заказ можно картой, наличными курьеру или по счету для юрлиц.",
+    "Возврат товара надлежащего качества возможен в течение 14 дней.",
+    "Телефон службы поддержки: +7 (495) 123-45-67, ежедневно с 9 до 21.",
+    "Артикул SKU-123-45: чайник заварочный стеклянный, объем 1,2 л.",
+    "Гарантия на технику - 12 месяцев с даты покупки.",
+    "Как изменить адрес доставки после оформления заказа?",
+    "Пункты самовывоза работают без выходных.",
+    "Free shipping applies to orders over 50 dollars within the country.",
+    "Our support team answers e-mails within one business day.",
+    "The warranty does not cover damage caused by improper use.",
+    "How do I reset my account password?",
+    "Цены на сайте указаны с учетом НДС.",
+    "Скидка 10% действует при первом заказе через мобильное приложение.",
+    "Сертификаты соответствия доступны на странице товара.",
+    "Order status can be tracked in your personal account."
+]
+
+
+def load_embedding_model(model_name: str, backend: str) -> Tuple[SentenceTransformer, str]:
+    """Модель эмбеддингов и фактически использованный бэкенд"""
+    if backend not in BACKENDS:
+        logging.warning(f"Неизвестный бэкенд модели эмбеддингов {backend}, используется {BACKEND_TORCH}")
+        backend = BACKEND_TORCH
+
+    model = None
+    if backend == BACKEND_TORCH_INT8 and not torch.cuda.is_available():
+        model = _load_torch_int8(model_name)
+    elif backend == BACKEND_ONNX:
+        model = _load_onnx(model_name)
+    elif backend == BACKEND_ONNX_INT8:
+        model = _load_onnx_int8(model_name)
+
+    if model is None:
+        backend = BACKEND_TORCH
+        model = SentenceTransformer(model_name)
+
+    return model, backend
+
+
+def _load_torch_int8(model_name: str):
+    """Модель с int8 весами линейных слоев (активации квантуются на лету)"""
+    try:
+        model = SentenceTransformer(model_name, device='cpu')
+        model.eval()
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    except Exception as e:
+        logging.warning(f"int8 квантование модели эмбеддингов недоступно ({e}), используется {BACKEND_TORCH}")
+        return None
+
+
+def _load_onnx(model_name: str):
+    try:
+        return SentenceTransformer(model_name, backend='onnx')
+    except Exception as e:
+        logging.warning(f"ONNX бэкенд модели эмбеддингов недоступен ({e}), используется {BACKEND_TORCH}")
+        return None
+
+
+def _load_onnx_int8(model_name: str):
+    """ONNX граф с int8 весами (при первой загрузке экспортируется и квантуется)"""
+    path = os.path.join(config.ONNX_MODELS_PATH, model_name.replace('/', '__'))
+    try:
+        if not os.path.exists(os.path.join(path, ONNX_INT8_FILE)):
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            logging.info(f"Экспорт int8 ONNX графа модели эмбеддингов в {path}...")
+            model = SentenceTransformer(model_name, backend='onnx')
+            model.save(path)
+            export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, path)
+
+        return SentenceTransformer(path, backend='onnx', model_kwargs={'file_name': ONNX_INT8_FILE})
+    except Exception as e:
+        logging.warning(f"int8 ONNX бэкенд модели эмбеддингов недоступен ({e}), используется {BACKEND_TORCH}")
+        return None
+
+
+def check_backend_parity(model_name: str, model: SentenceTransformer, backend: str) -> Dict[str, float]:
+    """Сравнение эмбеддингов бэкенда с эталонной моделью torch на контрольных текстах"""
+    reference = SentenceTransformer(model_name, device='cpu')
+    parity = embedding_parity(model.encode(PARITY_TEXTS), reference.encode(PARITY_TEXTS))
+    if parity['min_cosine'] < config.EMBEDDING_PARITY_MIN_COSINE:
+        logging.warning(
+            f"Эмбеддинги бэкенда {backend} расходятся с {BACKEND_TORCH} (min cos {parity['min_cosine']}): "
+            f"векторы хранилищ нужно переиндексировать или использовать EMBEDDING_BACKEND={BACKEND_TORCH}"
+        )
+    return parity
+
+
+def embedding_parity(embeddings: np.ndarray, reference: np.ndarray) -> Dict[str, float]:
+    """Косинусное сходство построчно соответствующих эмбеддингов двух бэкендов"""
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cosine = np.sum(embeddings * reference, axis=1)
+    return {
+        'samples': int(len(cosine)),
+        'min_cosine': round(float(cosine.min()), 4) if len(cosine) else 1.0,
+        'mean_cosine': round(float(cosine.mean()), 4) if len(cosine) else 1.0
+    }
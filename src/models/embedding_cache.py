@@ -0,0 +1,167 @@
+"""
+Постоянный кэш эмбеддингов чанков, адресуемый содержимым
+
+Ключ - хэш (имя модели, текст чанка), значение - нормализованный
+эмбеддинг. Векторы дописываются в файл vectors.f32 и читаются через
+отображение в память, ключи - в keys.bin в том же порядке строк; таблица
+ключ -> строка строится при открытии. Ключ дописывается после вектора,
+поэтому после сбоя оба файла обрезаются до числа полных ключей. При
+переобучении проекта на почти не изменившемся сайте эмбеддинги большинства
+чанков берутся из кэша, и модель кодирует только новые тексты.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+KEY_BYTES = 16
+KEYS_FILE = 'keys.bin'
+VECTORS_FILE = 'vectors.f32'
+META_FILE = 'cache.json'
+
+
+class EmbeddingCache:
+    """Кэш эмбеддингов одной модели в каталоге path
+
+    При достижении max_rows кэш очищается и заполняется заново: так размер
+    на диске ограничен, а эмбеддинги актуальных текстов быстро возвращаются
+    при следующем обучении.
+    """
+
+    def __init__(self, path: str, model_name: str, max_rows: int):
+        self.path = path
+        self.model_name = model_name
+        self.max_rows = max_rows
+        self.dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _key(self, text: str) -> bytes:
+        data = self.model_name.encode('utf-8') + b'\0' + text.encode('utf-8')
+        return hashlib.blake2b(data, digest_size=KEY_BYTES).digest()
+
+    def _load(self):
+        """Чтение ключей и обрезка недописанного хвоста после сбоя"""
+        try:
+            with open(self._file(META_FILE), 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"Ошибка чтения кэша эмбеддингов {self.path}: {e}")
+            self._reset()
+            return
+
+        with open(self._file(KEYS_FILE), 'ab+') as f:
+            f.seek(0)
+            keys = f.read()
+        vector_bytes = os.path.getsize(self._file(VECTORS_FILE)) if os.path.exists(self._file(VECTORS_FILE)) else 0
+        rows = min(len(keys) // KEY_BYTES, vector_bytes // (4 * self.dim))
+
+        self._truncate(rows)
+        self._rows = {keys[i * KEY_BYTES:(i + 1) * KEY_BYTES]: i for i in range(rows)}
+        logging.info(f"Кэш эмбеддингов {self.path}: {rows} векторов")
+
+    def _truncate(self, rows: int):
+        with open(self._file(KEYS_FILE), 'ab') as f:
+            f.truncate(rows * KEY_BYTES)
+        with open(self._file(VECTORS_FILE), 'ab') as f:
+            f.truncate(rows * 4 * self.dim)
+
+    def _reset(self):
+        """Удаление всех записей кэша"""
+        for name in (KEYS_FILE, VECTORS_FILE, META_FILE):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        self.dim = None
+        self._rows = {}
+        self._vectors = None
+
+    def _vector_file(self, rows: int) -> np.ndarray:
+        """Файл векторов, отображенный в память, не короче rows строк"""
+        if self._vectors is None or len(self._vectors) < rows:
+            self._vectors = np.memmap(self._file(VECTORS_FILE), dtype='float32', mode='r',
+                                      shape=(len(self._rows), self.dim))
+        return self._vectors
+
+    def get_many(self, texts: List[str]) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """Эмбеддинги найденных текстов и маска найденных
+
+        Возвращает матрицу (len(texts), dim), строки которой заполнены для
+        найденных текстов, или None, если не найдено ни одного.
+        """
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            rows = np.array([self._rows.get(key, -1) for key in keys], dtype=np.int64)
+            found = rows >= 0
+            self.hits += int(found.sum())
+            self.misses += int(len(rows) - found.sum())
+            if not found.any():
+                return None, found
+
+            embeddings = np.zeros((len(texts), self.dim), dtype='float32')
+            embeddings[found] = self._vector_file(int(rows.max()) + 1)[rows[found]]
+        return embeddings, found
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        """Сохранение эмбеддингов текстов (уже сохраненные пропускаются)"""
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        with self._lock:
+            if self.dim is not None and self.dim != embeddings.shape[1]:
+                logging.warning(f"Размерность эмбеддингов изменилась, кэш {self.path} очищается")
+                self._reset()
+            if len(self._rows) + len(texts) > self.max_rows:
+                logging.info(f"Кэш эмбеддингов {self.path} заполнен ({len(self._rows)} векторов), очистка")
+                self._reset()
+
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                with open(self._file(META_FILE), 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim, 'model': self.model_name}, f)
+
+            new: Dict[bytes, int] = {}
+            for i, text in enumerate(texts):
+                key = self._key(text)
+                if key not in self._rows and key not in new:
+                    new[key] = i
+            if not new:
+                return
+
+            # Сначала векторы, затем ключи: ключ без вектора после сбоя не появится,
+            # а при ошибке записи обе части откатываются, чтобы строки не сдвинулись
+            try:
+                with open(self._file(VECTORS_FILE), 'ab') as f:
+                    f.write(embeddings[list(new.values())].tobytes())
+                with open(self._file(KEYS_FILE), 'ab') as f:
+                    f.write(b''.join(new))
+            except Exception:
+                self._truncate(len(self._rows))
+                raise
+
+            for key in new:
+                self._rows[key] = len(self._rows)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Размер кэша и попадания"""
+        with self._lock:
+            return {
+                'vectors': len(self._rows),
+                'max_vectors': self.max_rows,
+                'bytes': len(self._rows) * 4 * (self.dim or 0),
+                'hits': self.hits,
+                'misses': self.misses
+            }
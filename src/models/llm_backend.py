@@ -0,0 +1,122 @@
+"""
+Бэкенды инференса языковой модели на CPU
+
+torch       - веса float32 (float16 на GPU), как раньше
+torch_int8  - динамическое int8 квантование линейных слоев (torch.quantization)
+onnx        - граф ONNX Runtime с KV-кэшем (optimum[onnxruntime]); экспортируется при первой
+              загрузке и сохраняется в ONNX_MODELS_PATH
+
+Все бэкенды возвращают модель с методом generate, поэтому пакетная и
+потоковая генерация работают с ними одинаково. Если бэкенд недоступен
+(нет optimum или нет поддержки квантования в сборке torch), модель
+загружается бэкендом torch.
+"""
+
+import os
+import shutil
+from typing import Tuple, Any
+import logging
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers.pytorch_utils import Conv1D
+
+import config
+
+BACKEND_TORCH = 'torch'
+BACKEND_TORCH_INT8 = 'torch_int8'
+BACKEND_ONNX = 'onnx'
+BACKENDS = (BACKEND_TORCH, BACKEND_TORCH_INT8, BACKEND_ONNX)
+
+
+def load_llm(model_name: str, backend: str) -> Tuple[Any, Any, str]:
+    """Токенизатор, модель и фактически использованный бэкенд"""
+    if backend not in BACKENDS:
+        logging.warning(f"Неизвестный бэкенд языковой модели {backend}, используется {BACKEND_TORCH}")
+        backend = BACKEND_TORCH
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # Добавляем pad_token если его нет
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    model = None
+    if backend == BACKEND_ONNX:
+        model = _load_onnx(model_name)
+    elif backend == BACKEND_TORCH_INT8 and not torch.cuda.is_available():
+        model = _load_torch_int8(model_name)
+
+    if model is None:
+        backend = BACKEND_TORCH
+        model = _load_torch(model_name)
+
+    return tokenizer, model, backend
+
+
+def _load_torch(model_name: str):
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+        device_map="auto" if torch.cuda.is_available() else None
+    )
+    model.eval()
+    return model
+
+
+def _load_torch_int8(model_name: str):
+    """Модель с int8 весами линейных слоев (активации квантуются на лету)"""
+    try:
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+        model.eval()
+        # В GPT-2 подобных моделях проекции - Conv1D, quantize_dynamic их не видит
+        _conv1d_to_linear(model)
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    except Exception as e:
+        logging.warning(f"int8 квантование недоступно ({e}), используется {BACKEND_TORCH}")
+        return None
+
+
+def _conv1d_to_linear(module: torch.nn.Module):
+    """Замена слоев Conv1D (вес in x out) эквивалентными nn.Linear (вес out x in)"""
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+            linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def _load_onnx(model_name: str):
+    """Модель ONNX Runtime с KV-кэшем (при первой загрузке экспортируется из весов transformers)"""
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError:
+        logging.warning(f"optimum[onnxruntime] не установлен, используется {BACKEND_TORCH}")
+        return None
+
+    path = os.path.join(config.ONNX_MODELS_PATH, model_name.replace('/', '__'))
+    try:
+        if not _has_onnx_graph(path):
+            # Экспорт занимает минуты, поэтому граф сохраняется и при следующих запусках
+            # загружается с диска; каталог подменяется целиком, чтобы не оставить половину экспорта
+            logging.info(f"Экспорт языковой модели в ONNX в {path}...")
+            tmp_path = f"{path}.export"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            model = ORTModelForCausalLM.from_pretrained(model_name, export=True, use_cache=True)
+            model.save_pretrained(tmp_path)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+            return model
+
+        return ORTModelForCausalLM.from_pretrained(path, use_cache=True)
+    except Exception as e:
+        logging.warning(f"Ошибка экспорта модели в ONNX ({e}), используется {BACKEND_TORCH}")
+        return None
+
+
+def _has_onnx_graph(path: str) -> bool:
+    """В каталоге уже есть экспортированный ONNX граф"""
+    return os.path.isdir(path) and any(name.endswith('.onnx') for name in os.listdir(path))
@@ -0,0 +1,258 @@
+"""
+Общий реестр ИИ моделей процесса
+
+Веса моделей эмбеддингов и языковых моделей загружаются один раз на процесс
+и используются всеми экземплярами ChatbotModel только для чтения.
+Загрузка может выполняться в фоновом потоке с прогревом, чтобы приложение
+начинало обслуживать запросы сразу после старта. Каждый ресурс создается
+под своей блокировкой, поэтому долгая загрузка одной модели не задерживает
+получение других ресурсов.
+"""
+
+import os
+import threading
+from typing import Dict, Tuple, Any, Optional
+import logging
+
+import torch
+from sentence_transformers import SentenceTransformer
+
+import config
+from models.batching import EmbeddingBatcher, GenerationBatcher
+from models.reranker import Reranker
+from models.llm_backend import load_llm
+from models.embedding_backend import BACKEND_TORCH, load_embedding_model, check_backend_parity
+from models.embedding_cache import EmbeddingCache
+
+# Состояния загрузки набора моделей
+STATE_NOT_LOADED = 'not_loaded'
+STATE_LOADING = 'loading'
+STATE_WARMING = 'warming'
+STATE_READY = 'ready'
+STATE_ERROR = 'error'
+
+
+def generation_kwargs(tokenizer) -> Dict[str, Any]:
+    """Параметры генерации ответов чат-бота"""
+    return {
+        'max_new_tokens': config.MAX_RESPONSE_LENGTH,
+        'do_sample': True,
+        'temperature': 0.7,
+        'top_p': 0.9,
+        'pad_token_id': tokenizer.eos_token_id,
+        'eos_token_id': tokenizer.eos_token_id
+    }
+
+
+class ModelRegistry:
+    """Реестр моделей, ключом служит имя модели"""
+
+    def __init__(self):
+        self._embedding_models: Dict[str, SentenceTransformer] = {}
+        self._llms: Dict[str, Tuple[Any, Any]] = {}
+        self._llm_backends: Dict[str, str] = {}
+        self._embedding_backends: Dict[str, str] = {}
+        self._embedding_parity: Dict[str, Dict[str, float]] = {}
+        self._embedding_batchers: Dict[str, EmbeddingBatcher] = {}
+        self._generation_batchers: Dict[str, GenerationBatcher] = {}
+        self._rerankers: Dict[str, Reranker] = {}
+        self._embedding_caches: Dict[str, EmbeddingCache] = {}
+        # Общая блокировка защищает только таблицу блокировок ресурсов (вид, имя модели)
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+        # Состояние фоновой загрузки по паре (модель эмбеддингов, языковая модель)
+        self._state_lock = threading.Lock()
+        self._states: Dict[Tuple[str, str], str] = {}
+        self._errors: Dict[Tuple[str, str], str] = {}
+        self._ready_events: Dict[Tuple[str, str], threading.Event] = {}
+
+    def _load_lock(self, kind: str, model_name: str) -> threading.Lock:
+        """Блокировка создания ресурса данного вида для модели"""
+        with self._lock:
+            return self._load_locks.setdefault((kind, model_name), threading.Lock())
+
+    def get_embedding_model(self, model_name: str) -> SentenceTransformer:
+        """Получение (при необходимости загрузка) модели эмбеддингов"""
+        with self._load_lock('embedding', model_name):
+            if model_name not in self._embedding_models:
+                logging.info(f"Загрузка модели эмбеддингов {model_name} (бэкенд {config.EMBEDDING_BACKEND})...")
+                model, backend = load_embedding_model(model_name, config.EMBEDDING_BACKEND)
+                self._embedding_backends[model_name] = backend
+                self._embedding_models[model_name] = model
+            return self._embedding_models[model_name]
+
+    def get_embedding_backend(self, model_name: str) -> Optional[str]:
+        """Бэкенд, которым загружена модель эмбеддингов (None, если модель не загружена)"""
+        return self._embedding_backends.get(model_name)
+
+    def get_embedding_parity(self, model_name: str) -> Optional[Dict[str, float]]:
+        """Косинусное сходство бэкенда модели эмбеддингов с torch (None для torch или до проверки)"""
+        return self._embedding_parity.get(model_name)
+
+    def _check_embedding_parity(self, model_name: str, embedding_model: SentenceTransformer):
+        """Однократная проверка бэкенда, отличного от torch, при фоновой загрузке"""
+        with self._load_lock('embedding_parity', model_name):
+            backend = self._embedding_backends.get(model_name, BACKEND_TORCH)
+            if backend == BACKEND_TORCH or model_name in self._embedding_parity:
+                return
+            try:
+                self._embedding_parity[model_name] = check_backend_parity(model_name, embedding_model, backend)
+            except Exception as e:
+                logging.error(f"Ошибка проверки совместимости эмбеддингов: {e}")
+
+    def get_embedding_batcher(self, model_name: str) -> EmbeddingBatcher:
+        """Общий планировщик микро-пакетов для эмбеддингов запросов модели"""
+        embedding_model = self.get_embedding_model(model_name)
+        with self._load_lock('embedding_batcher', model_name):
+            if model_name not in self._embedding_batchers:
+                self._embedding_batchers[model_name] = EmbeddingBatcher(
+                    embedding_model,
+                    config.EMBEDDING_BATCH_WINDOW_MS,
+                    config.EMBEDDING_BATCH_MAX_SIZE
+                )
+            return self._embedding_batchers[model_name]
+
+    def get_embedding_cache(self, model_name: str) -> EmbeddingCache:
+        """Общий постоянный кэш эмбеддингов чанков модели и ее бэкенда"""
+        backend = self.get_embedding_backend(model_name) or config.EMBEDDING_BACKEND
+        with self._load_lock('embedding_cache', model_name):
+            if model_name not in self._embedding_caches:
+                # Эмбеддинги разных бэкендов различаются, у каждого свой кэш
+                # (кэш torch остается в прежней директории без суффикса)
+                name = model_name.replace('/', '__')
+                if backend != BACKEND_TORCH:
+                    name += f'__{backend}'
+                path = os.path.join(config.EMBEDDING_CACHE_PATH, name)
+                self._embedding_caches[model_name] = EmbeddingCache(
+                    path, model_name, config.EMBEDDING_CACHE_MAX_ROWS
+                )
+            return self._embedding_caches[model_name]
+
+    def get_llm(self, model_name: str) -> Tuple[Any, Any]:
+        """Получение (при необходимости загрузка) токенизатора и языковой модели"""
+        with self._load_lock('llm', model_name):
+            if model_name not in self._llms:
+                logging.info(f"Загрузка языковой модели {model_name} (бэкенд {config.LLM_BACKEND})...")
+                tokenizer, model, backend = load_llm(model_name, config.LLM_BACKEND)
+                self._llm_backends[model_name] = backend
+
+                self._llms[model_name] = (tokenizer, model)
+            return self._llms[model_name]
+
+    def get_llm_backend(self, model_name: str) -> Optional[str]:
+        """Бэкенд, которым загружена языковая модель (None, если модель не загружена)"""
+        return self._llm_backends.get(model_name)
+
+    def get_generation_batcher(self, model_name: str) -> GenerationBatcher:
+        """Общий планировщик пакетной генерации для языковой модели"""
+        tokenizer, llm_model = self.get_llm(model_name)
+        with self._load_lock('generation_batcher', model_name):
+            if model_name not in self._generation_batchers:
+                self._generation_batchers[model_name] = GenerationBatcher(
+                    tokenizer,
+                    llm_model,
+                    config.LLM_BATCH_WAIT_MS,
+                    config.LLM_BATCH_MAX_SIZE,
+                    generation_kwargs(tokenizer)
+                )
+            return self._generation_batchers[model_name]
+
+    def get_reranker(self, model_name: str) -> Reranker:
+        """Общая модель переранжирования (загружается в фоне при первом запросе)"""
+        with self._load_lock('reranker', model_name):
+            if model_name not in self._rerankers:
+                self._rerankers[model_name] = Reranker(model_name)
+            return self._rerankers[model_name]
+
+    def start_background_loading(self, embedding_name: str, llm_name: str):
+        """Запуск фоновой загрузки и прогрева моделей (повторный вызов ничего не делает)"""
+        key = (embedding_name, llm_name)
+        with self._state_lock:
+            if self._states.get(key, STATE_NOT_LOADED) not in (STATE_NOT_LOADED, STATE_ERROR):
+                return
+            self._states[key] = STATE_LOADING
+            self._errors.pop(key, None)
+            self._ready_events[key] = threading.Event()
+
+        thread = threading.Thread(
+            target=self._load_and_warm_up,
+            args=(embedding_name, llm_name),
+            name='model-loader'
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _load_and_warm_up(self, embedding_name: str, llm_name: str):
+        """Загрузка моделей и прогон прогревочного инференса"""
+        key = (embedding_name, llm_name)
+        try:
+            embedding_model = self.get_embedding_model(embedding_name)
+            tokenizer, llm_model = self.get_llm(llm_name)
+
+            self._set_state(key, STATE_WARMING)
+            self._warm_up(embedding_model, tokenizer, llm_model)
+            self._check_embedding_parity(embedding_name, embedding_model)
+
+            self._set_state(key, STATE_READY)
+            logging.info("Модели успешно инициализированы")
+
+        except Exception as e:
+            logging.error(f"Ошибка фоновой загрузки моделей: {e}")
+            with self._state_lock:
+                self._errors[key] = str(e)
+            self._set_state(key, STATE_ERROR)
+
+        finally:
+            self._ready_events[key].set()
+
+    def _warm_up(self, embedding_model, tokenizer, llm_model):
+        """Прогревочный инференс, чтобы первый запрос не попадал на холодные ядра и кэши"""
+        logging.info("Прогрев моделей...")
+        embedding_model.encode(["Прогрев модели эмбеддингов"])
+
+        inputs = tokenizer.encode("Вопрос пользователя: привет\nОтвет:", return_tensors='pt')
+        with torch.no_grad():
+            llm_model.generate(
+                inputs,
+                max_new_tokens=4,
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id
+            )
+
+    def _set_state(self, key: Tuple[str, str], state: str):
+        """Смена состояния загрузки"""
+        with self._state_lock:
+            self._states[key] = state
+
+    def get_state(self, embedding_name: str, llm_name: str) -> str:
+        """Текущее состояние загрузки: not_loaded, loading, warming, ready или error"""
+        with self._state_lock:
+            return self._states.get((embedding_name, llm_name), STATE_NOT_LOADED)
+
+    def get_error(self, embedding_name: str, llm_name: str) -> Optional[str]:
+        """Текст ошибки последней загрузки"""
+        with self._state_lock:
+            return self._errors.get((embedding_name, llm_name))
+
+    def wait_until_ready(self, embedding_name: str, llm_name: str, timeout: Optional[float] = None) -> bool:
+        """Ожидание окончания загрузки; True, если модели готовы"""
+        self.start_background_loading(embedding_name, llm_name)
+        with self._state_lock:
+            event = self._ready_events[(embedding_name, llm_name)]
+        event.wait(timeout)
+        return self.get_state(embedding_name, llm_name) == STATE_READY
+
+    def loaded_models(self) -> Dict[str, list]:
+        """Список загруженных моделей"""
+        return {
+            'embedding': list(self._embedding_models.keys()),
+            'embedding_backend': dict(self._embedding_backends),
+            'llm': list(self._llms.keys()),
+            'llm_backend': dict(self._llm_backends),
+            'reranker': [name for name, reranker in self._rerankers.items() if reranker.is_ready()]
+        }
+
+
+# Глобальный реестр процесса
+model_registry = ModelRegistry()
@@ -4,9 +4,10 @@
 
 import os
 import json
+import shutil
 import sqlite3
 import uuid
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 from datetime import datetime
 import logging
 import asyncio
@@ -14,6 +15,8 @@ import asyncio
 import config
 from models.web_scraper import WebScraper, SimpleScraper
 from models.chatbot import ChatbotModel
+from models.vector_store import pq_subquantizers, QUANTIZATION_PQ
+from models.session_store import SessionStore
 from models.data_processor import DocumentProcessor
 
 
@@ -21,7 +24,7 @@ class ProjectManager:
     """Менеджер проектов для создания специализированных чат-ботов"""
     
     def __init__(self):
-        self.db_path = os.path.join(config.BASE_DIR, 'projects.db')
+        self.db_path = config.PROJECTS_DB_PATH
         self.projects_dir = os.path.join(config.BASE_DIR, 'projects')
         
         # Создаем директории если не существуют
@@ -256,6 +259,7 @@ class ProjectManager:
     
     def start_training(self, project_id: str) -> Dict[str, Any]:
         """Запуск обучения модели для проекта"""
+        chatbot = None
         try:
             project = self.get_project(project_id)
             if not project:
@@ -274,20 +278,26 @@ class ProjectManager:
                 self._update_project_status(project_id, 'training_failed')
                 return {'status': 'error', 'message': 'Нет данных для обучения'}
             
-            # Создаем специализированный чат-бот
-            chatbot = ChatbotModel()
+            # Хранилище проекта строится с нуля, без общей базы знаний, во временной директории
+            # рядом с рабочей; загруженный ранее чат-бот отвечает по старому хранилищу до подмены
+            project_vector_store = self._project_vector_store_path(project_id)
+            building_path = project_vector_store + '.building'
+            if os.path.exists(building_path):
+                shutil.rmtree(building_path)
+            chatbot = self._create_project_chatbot(project, building_path)
             
-            # Обучаем на собранных данных
-            total_text = ""
-            for item in project_data:
-                total_text += f"\n\n{item['content']}"
-            
-            # Обновляем базу знаний
-            chatbot.update_knowledge_base(total_text, f"project_{project_id}")
+            # Обучаем на собранных данных: тексты передаются чанкеру потоком, без склейки в одну строку
+            ingestion_stats = chatbot.update_knowledge_base(
+                (f"\n\n{item['content']}" for item in project_data),
+                f"project_{project_id}"
+            )
             
             # Сохраняем модель
             self._save_project_model(project_id, chatbot)
             
+            # Подменяем хранилище проекта и кэшируем обученный чат-бот
+            self._swap_project_vector_store(project_id, chatbot, building_path)
+            
             # Обновляем статус
             self._update_project_status(project_id, 'ready')
             self._update_project_field(project_id, 'training_completed_at', datetime.now().isoformat())
@@ -297,12 +307,16 @@ class ProjectManager:
                 'message': 'Обучение завершено успешно',
                 'model_stats': {
                     'vector_store_size': chatbot.get_vector_store_size(),
-                    'training_data_size': len(total_text)
+                    'training_data_size': sum(len(item['content']) + 2 for item in project_data),
+                    'ingestion': ingestion_stats
                 }
             }
             
         except Exception as e:
             logging.error(f"Ошибка обучения проекта {project_id}: {e}")
+            if chatbot is not None and chatbot.vector_store_path != self._project_vector_store_path(project_id):
+                chatbot.vector_store.close()
+            shutil.rmtree(self._project_vector_store_path(project_id) + '.building', ignore_errors=True)
             self._update_project_status(project_id, 'training_failed')
             return {'status': 'error', 'message': str(e)}
     
@@ -333,18 +347,51 @@ class ProjectManager:
             logging.error(f"Ошибка получения данных проекта {project_id}: {e}")
             return []
     
+    def _project_vector_store_path(self, project_id: str) -> str:
+        """Директория векторного хранилища проекта"""
+        return os.path.join(self.projects_dir, project_id, 'vector_store')
+    
+    def _swap_project_vector_store(self, project_id: str, chatbot: ChatbotModel, building_path: str):
+        """Перенос построенного хранилища в директорию проекта вместо прежнего"""
+        project_vector_store = self._project_vector_store_path(project_id)
+        
+        # Фоновые потоки обоих хранилищ не должны писать в переносимые и удаляемые директории
+        chatbot.vector_store.close()
+        previous = self.active_chatbots.pop(project_id, None)
+        if previous is not None:
+            previous.vector_store.close()
+        
+        # Директорию нельзя заменить непустой: прежняя сначала отодвигается в сторону
+        old_path = project_vector_store + '.old'
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        if os.path.exists(project_vector_store):
+            os.replace(project_vector_store, old_path)
+        os.replace(building_path, project_vector_store)
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        
+        # Хранилище переоткрывается по новому пути (базовый снимок уже сохранен компактизацией)
+        chatbot.vector_store_path = project_vector_store
+        chatbot._initialize_vector_store()
+        self.active_chatbots[project_id] = chatbot
+    
+    def _create_project_chatbot(self, project: Dict[str, Any], vector_store_path: str) -> ChatbotModel:
+        """Чат-бот проекта с его хранилищем, параметрами поиска (nprobe / efSearch) и квантованием векторов"""
+        return ChatbotModel(
+            vector_store_path=vector_store_path,
+            session_store=SessionStore(self.db_path, project['id'], persist=False),
+            search_params=project['config'].get('search_params', {}),
+            quantization=project['config'].get('quantization')
+        )
+    
     def _save_project_model(self, project_id: str, chatbot: ChatbotModel):
         """Сохранение модели проекта"""
         try:
             project_dir = os.path.join(self.projects_dir, project_id)
             
-            # Сохраняем векторное хранилище в директорию проекта
-            import shutil
-            if os.path.exists(config.VECTOR_STORE_PATH):
-                project_vector_store = os.path.join(project_dir, 'vector_store')
-                if os.path.exists(project_vector_store):
-                    shutil.rmtree(project_vector_store)
-                shutil.copytree(config.VECTOR_STORE_PATH, project_vector_store)
+            # Хранилище уже записано на диск; базовый снимок индекса ускоряет загрузку
+            chatbot.vector_store.compact()
             
             # Сохраняем метаданные модели
             model_metadata = {
@@ -376,23 +423,14 @@ class ProjectManager:
                 return None
             
             # Загружаем модель
-            project_dir = os.path.join(self.projects_dir, project_id)
-            project_vector_store = os.path.join(project_dir, 'vector_store')
+            project_vector_store = self._project_vector_store_path(project_id)
             
             if not os.path.exists(project_vector_store):
                 return None
             
-            # Создаем чат-бот и загружаем данные
-            chatbot = ChatbotModel()
-            
-            # Временно подменяем путь к векторному хранилищу
-            original_path = config.VECTOR_STORE_PATH
-            config.VECTOR_STORE_PATH = project_vector_store
-            
-            try:
-                chatbot._initialize_vector_store()
-            finally:
-                config.VECTOR_STORE_PATH = original_path
+            # Создаем чат-бот с хранилищем проекта; обмены сессий проекта сохраняет
+            # _save_chat_session, хранилище сессий только подгружает их
+            chatbot = self._create_project_chatbot(project, project_vector_store)
             
             # Кэшируем
             self.active_chatbots[project_id] = chatbot
@@ -432,6 +470,18 @@ class ProjectManager:
                 'message': str(e)
             }
     
+    def chat_with_project_stream(self, project_id: str, message: str, session_id: str) -> Iterator[Dict[str, str]]:
+        """Потоковый чат с проектным чат-ботом, итоговый ответ сохраняется в сессию"""
+        chatbot = self.get_project_chatbot(project_id)
+        if not chatbot:
+            yield {'event': 'done', 'response': 'Чат-бот проекта не доступен'}
+            return
+        
+        for item in chatbot.generate_response_stream(message, session_id):
+            if item['event'] == 'done':
+                self._save_chat_session(project_id, session_id, message, item['response'])
+            yield item
+    
     def _save_chat_session(self, project_id: str, session_id: str, user_message: str, bot_response: str):
         """Сохранение сессии чата"""
         try:
@@ -822,6 +872,53 @@ if __name__ == '__main__':
 '''
         }
     
+    def update_search_params(self, project_id: str, nprobe: Optional[int] = None,
+                             ef_search: Optional[int] = None,
+                             quantization: Optional[str] = None) -> Dict[str, Any]:
+        """Настройка баланса полноты, скорости поиска и памяти индекса для проекта"""
+        try:
+            project = self.get_project(project_id)
+            if not project:
+                return {'status': 'error', 'message': 'Проект не найден'}
+            
+            # Размерность известна у загруженного хранилища; PQ требует делителя больше 1
+            chatbot = self.active_chatbots.get(project_id)
+            vector_store = chatbot.vector_store if chatbot is not None else None
+            if quantization == QUANTIZATION_PQ and vector_store is not None and vector_store.dim \
+                    and pq_subquantizers(vector_store.dim) == 1:
+                return {
+                    'status': 'error',
+                    'message': f'PQ невозможен для размерности эмбеддингов {vector_store.dim}, используйте sq8'
+                }
+            
+            project_config = project['config']
+            search_params = project_config.get('search_params', {})
+            if nprobe:
+                search_params['nprobe'] = int(nprobe)
+            if ef_search:
+                search_params['ef_search'] = int(ef_search)
+            project_config['search_params'] = search_params
+            if quantization:
+                project_config['quantization'] = quantization
+            
+            self._update_project_field(project_id, 'config', json.dumps(project_config))
+            
+            # Применяем к загруженному чат-боту
+            if vector_store is not None:
+                vector_store.set_search_params(**search_params)
+                if quantization:
+                    vector_store.set_quantization(quantization)
+            
+            return {
+                'status': 'success',
+                'search_params': search_params,
+                'quantization': project_config.get('quantization', config.VECTOR_QUANTIZATION)
+            }
+            
+        except Exception as e:
+            logging.error(f"Ошибка настройки поиска проекта {project_id}: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
     def _update_project_status(self, project_id: str, status: str):
         """Обновление статуса проекта"""
         try:
@@ -860,7 +957,6 @@ if __name__ == '__main__':
                 conn.commit()
             
             # Удаляем директорию проекта
-            import shutil
             project_dir = os.path.join(self.projects_dir, project_id)
             if os.path.exists(project_dir):
                 shutil.rmtree(project_dir)
@@ -0,0 +1,116 @@
+"""
+Переранжирование кандидатов поиска кросс-энкодером
+
+Кросс-энкодер оценивает пару (запрос, чанк) точнее, чем сходство
+эмбеддингов, но заметно дороже, поэтому работает в пределах бюджета
+времени: по скользящей оценке стоимости одной пары переранжируется
+столько лучших кандидатов, сколько успевает в оставшийся бюджет, а если
+не успевает ни одна пара - этап пропускается.
+"""
+
+import time
+import threading
+from typing import List, Dict, Any, Optional
+import logging
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+# Коэффициент скользящего среднего стоимости пары
+COST_EMA_ALPHA = 0.2
+# Минимум кандидатов, ради которого имеет смысл вызывать модель
+MIN_RERANK_CANDIDATES = 2
+
+
+class Reranker:
+    """Кросс-энкодер с загрузкой в фоне и оценкой стоимости вызова"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.model: Optional[CrossEncoder] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+        # Скользящая оценка секунд на одну пару
+        self.cost_per_pair: Optional[float] = None
+        self.reranked = 0
+        self.skipped = 0
+
+        thread = threading.Thread(target=self._load, name='reranker-loader')
+        thread.daemon = True
+        thread.start()
+
+    def _load(self):
+        """Загрузка и прогрев модели"""
+        try:
+            logging.info(f"Загрузка модели переранжирования {self.model_name}...")
+            model = CrossEncoder(self.model_name)
+            self._timed_predict(model, [("прогрев", "прогрев модели переранжирования")])
+            self.model = model
+            logging.info("Модель переранжирования готова")
+        except Exception as e:
+            logging.error(f"Ошибка загрузки модели переранжирования: {e}")
+            self.error = str(e)
+
+    def is_ready(self) -> bool:
+        return self.model is not None
+
+    def _timed_predict(self, model: CrossEncoder, pairs: List[tuple]) -> np.ndarray:
+        """Оценка пар одним пакетом с обновлением оценки стоимости"""
+        started = time.perf_counter()
+        scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            per_pair = elapsed / len(pairs)
+            if self.cost_per_pair is None:
+                self.cost_per_pair = per_pair
+            else:
+                self.cost_per_pair += COST_EMA_ALPHA * (per_pair - self.cost_per_pair)
+        return np.asarray(scores, dtype='float32')
+
+    def _affordable(self, candidates: int, budget: float) -> int:
+        """Сколько кандидатов можно оценить за оставшийся бюджет (секунды)"""
+        with self._lock:
+            if self.cost_per_pair is None:
+                return candidates
+            return max(0, min(candidates, int(budget / self.cost_per_pair)))
+
+    def rerank(self, query: str, docs: List[Dict[str, Any]], top_k: int,
+               budget: float) -> Optional[List[Dict[str, Any]]]:
+        """Лучшие top_k документов после переранжирования
+
+        Возвращает None, если модель не загружена или бюджет исчерпан; тогда
+        используется исходный порядок. Кандидаты, не поместившиеся в бюджет,
+        остаются после переранжированных в исходном порядке.
+        """
+        if self.model is None or len(docs) < MIN_RERANK_CANDIDATES:
+            return None
+
+        count = self._affordable(len(docs), budget)
+        if count < MIN_RERANK_CANDIDATES:
+            self.skipped += 1
+            return None
+
+        head = docs[:count]
+        scores = self._timed_predict(self.model, [(query, doc['text']) for doc in head])
+        self.reranked += 1
+
+        order = np.argsort(-scores, kind='stable')
+        reranked = []
+        for i in order:
+            doc = dict(head[i])
+            doc['rerank_score'] = float(scores[i])
+            reranked.append(doc)
+        return (reranked + docs[count:])[:top_k]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние и оценка стоимости переранжирования"""
+        return {
+            'model': self.model_name,
+            'ready': self.is_ready(),
+            'error': self.error,
+            'ms_per_pair': round(self.cost_per_pair * 1000, 3) if self.cost_per_pair is not None else None,
+            'reranked': self.reranked,
+            'skipped': self.skipped
+        }
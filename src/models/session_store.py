@@ -0,0 +1,233 @@
+"""
+Ограниченное хранилище контекста сессий чата
+
+В памяти держатся только недавно активные сессии: число сессий и их
+суммарный размер ограничены, сессии без активности дольше ttl вытесняются.
+Вытесненные сессии с несохраненными сообщениями дописываются в таблицу
+chat_sessions (та же, что ведет ProjectManager) и подгружаются из нее при
+следующем обращении.
+"""
+
+import json
+import atexit
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+import logging
+
+import config
+
+# project_id для сессий общего чат-бота (не принадлежащих проекту)
+GLOBAL_SESSION_PROJECT = 'global'
+
+
+class _Session:
+    __slots__ = ('messages', 'unsaved', 'size', 'last_access')
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        self.messages = messages
+        self.unsaved: List[Dict[str, Any]] = []
+        self.size = 0
+        self.last_access = time.monotonic()
+
+
+class SessionStore:
+    """LRU кэш контекста сессий с TTL, бюджетом памяти и вытеснением в SQLite
+
+    persist=False - сообщения сохраняет вызывающий код (чат проекта пишет
+    каждый обмен через ProjectManager._save_chat_session), хранилище только
+    подгружает из таблицы вытесненные сессии.
+    """
+
+    def __init__(self, db_path: str, project_id: str = GLOBAL_SESSION_PROJECT, persist: bool = True,
+                 max_sessions: int = None, max_bytes: int = None, ttl: float = None,
+                 history_length: int = None):
+        self.db_path = db_path
+        self.project_id = project_id
+        self.persist = persist
+        self.max_sessions = max_sessions or config.SESSION_CACHE_MAX_SESSIONS
+        self.max_bytes = max_bytes or config.SESSION_CACHE_MAX_BYTES
+        self.ttl = ttl or config.SESSION_TTL
+        self.history_length = history_length or config.SESSION_HISTORY_LENGTH
+
+        self._sessions: 'OrderedDict[str, _Session]' = OrderedDict()
+        self._spilling: Dict[str, _Session] = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.total_bytes = 0
+        self.spilled = 0
+        self.reloaded = 0
+
+        self._init_table()
+        if self.persist:
+            atexit.register(self.flush)
+
+    def _init_table(self):
+        """Таблица сессий (если хранилище используется без ProjectManager)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS chat_sessions (
+                        id TEXT PRIMARY KEY,
+                        project_id TEXT NOT NULL,
+                        messages TEXT NOT NULL,
+                        created_at TEXT NOT NULL,
+                        updated_at TEXT NOT NULL,
+                        FOREIGN KEY (project_id) REFERENCES projects (id)
+                    )
+                ''')
+                conn.commit()
+        except Exception as e:
+            logging.error(f"Ошибка инициализации таблицы сессий: {e}")
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        """Последние сообщения сессии (из памяти или из базы)"""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is not None:
+                return list(session.messages)
+
+        session, evicted = self._open(session_id)
+        self._spill(evicted)
+        return list(session.messages)
+
+    def append(self, session_id: str, user_message: str, bot_response: str):
+        """Добавление обмена сообщениями в сессию"""
+        message = {
+            'user': user_message,
+            'bot': bot_response,
+            'timestamp': datetime.now().isoformat()
+        }
+
+        session, evicted = self._open(session_id, message)
+        self._spill(evicted)
+
+    def _open(self, session_id: str, message: Optional[Dict[str, Any]] = None) -> tuple:
+        """Сессия из памяти или из базы (чтение базы - вне блокировки) с добавлением сообщения"""
+        messages = None
+        while True:
+            with self._lock:
+                session = self._touch(session_id)
+                if session is None and messages is not None:
+                    session = self._insert(session_id, messages)
+                    if messages:
+                        self.reloaded += 1
+
+                if session is not None:
+                    if message is not None:
+                        session.messages = (session.messages + [message])[-self.history_length:]
+                        if self.persist:
+                            session.unsaved.append(message)
+                        self._resize(session)
+                    return session, self._evict()
+
+            messages = self._load(session_id)
+
+    def _touch(self, session_id: str) -> Optional[_Session]:
+        """Сессия из памяти с отметкой об обращении (под блокировкой)"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            # Сессия в процессе записи в базу возвращается в память вместе с несохраненными сообщениями
+            session = self._spilling.get(session_id)
+            if session is None:
+                return None
+            self._sessions[session_id] = session
+            self.total_bytes += session.size
+
+        self._sessions.move_to_end(session_id)
+        session.last_access = time.monotonic()
+        return session
+
+    def _insert(self, session_id: str, messages: List[Dict[str, Any]]) -> _Session:
+        session = _Session(messages[-self.history_length:])
+        self._sessions[session_id] = session
+        self._resize(session)
+        return session
+
+    def _resize(self, session: _Session):
+        size = len(json.dumps(session.messages, ensure_ascii=False).encode('utf-8'))
+        self.total_bytes += size - session.size
+        session.size = size
+
+    def _evict(self) -> List[tuple]:
+        """Вытеснение старых сессий сверх лимитов (под блокировкой); возвращает сессии для записи"""
+        evicted = []
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and self.total_bytes <= self.max_bytes \
+                    and session.last_access >= deadline:
+                break
+
+            del self._sessions[session_id]
+            self.total_bytes -= session.size
+            if session.unsaved:
+                self._spilling[session_id] = session
+                evicted.append((session_id, session))
+
+        return evicted
+
+    def _load(self, session_id: str) -> List[Dict[str, Any]]:
+        """Сообщения сессии из таблицы chat_sessions"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute('SELECT messages FROM chat_sessions WHERE id = ?', (session_id,)).fetchone()
+            return json.loads(row[0])[-self.history_length:] if row else []
+        except Exception as e:
+            logging.error(f"Ошибка загрузки сессии {session_id}: {e}")
+            return []
+
+    def _spill(self, evicted: List[tuple]):
+        """Дописывание несохраненных сообщений вытесненных сессий в базу"""
+        for session_id, session in evicted:
+            with self._lock:
+                unsaved, session.unsaved = session.unsaved, []
+            try:
+                self._write(session_id, unsaved)
+                self.spilled += 1
+            except Exception as e:
+                logging.error(f"Ошибка сохранения сессии {session_id}: {e}")
+                with self._lock:
+                    session.unsaved = unsaved + session.unsaved
+            finally:
+                with self._lock:
+                    if self._spilling.get(session_id) is session:
+                        del self._spilling[session_id]
+
+    def _write(self, session_id: str, messages: List[Dict[str, Any]]):
+        """Добавление сообщений в историю сессии в таблице chat_sessions"""
+        now = datetime.now().isoformat()
+        with self._db_lock, sqlite3.connect(self.db_path) as conn:
+            row = conn.execute('SELECT messages FROM chat_sessions WHERE id = ?', (session_id,)).fetchone()
+            if row:
+                conn.execute(
+                    'UPDATE chat_sessions SET messages = ?, updated_at = ? WHERE id = ?',
+                    (json.dumps(json.loads(row[0]) + messages), now, session_id)
+                )
+            else:
+                conn.execute(
+                    'INSERT INTO chat_sessions (id, project_id, messages, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    (session_id, self.project_id, json.dumps(messages), now, now)
+                )
+            conn.commit()
+
+    def flush(self):
+        """Запись всех несохраненных сообщений (при остановке процесса)"""
+        with self._lock:
+            pending = [(session_id, session) for session_id, session in self._sessions.items() if session.unsaved]
+        self._spill(pending)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Размер кэша сессий и счетчики вытеснения"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'spilled': self.spilled,
+                'reloaded': self.reloaded
+            }
@@ -0,0 +1,183 @@
+"""
+Потоковое разбиение текста на чанки по токенам
+
+Текст поступает частями (строка или любой итератор строк) и разбивается
+на предложения с учетом русской и английской пунктуации: граница - знак
+конца предложения, за которым идет заглавная буква или цифра, либо пустая
+строка между абзацами; точки в сокращениях (г., ул., Mr.) и инициалах
+границей не считаются. Предложения набираются в чанк, пока не превышен
+бюджет токенов; следующий чанк начинается с последних предложений
+предыдущего в пределах перекрытия. Каждое предложение токенизируется один
+раз, чанки собираются join без повторной конкатенации строк, поэтому
+время линейно по длине текста.
+"""
+
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
+
+# Конец предложения: знаки препинания, закрывающие кавычки/скобки, пробел и начало нового.
+# Группы нужны re.split: части текста чередуются со знаками конца и пробелами после них
+SENTENCE_END = re.compile(r'([.!?…]+["»”)\]]*)(\s+)(?=["«“(\[\-–—]?[A-ZА-ЯЁ0-9])|\n[ \t]*\n\s*')
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+WHITESPACE = re.compile(r'\s+')
+
+# Сокращения, после точки в которых предложение не заканчивается
+ABBREVIATIONS = {
+    'г', 'гг', 'ул', 'д', 'кв', 'им', 'стр', 'рис', 'см', 'напр', 'т', 'тыс', 'млн', 'млрд', 'руб',
+    'коп', 'проф', 'акад', 'пр', 'пер', 'обл', 'р', 'св', 'ст', 'гр', 'тел', 'доб',
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'st', 'vs', 'etc', 'no', 'inc', 'ltd', 'jr', 'sr', 'fig'
+}
+ABBREVIATION_MAX_CHARS = max(len(word) for word in ABBREVIATIONS)
+
+# Сколько предложений токенизируется одним вызовом
+COUNT_BATCH = 256
+# Предложение без границ длиннее этого числа символов принудительно обрывается по пробелу
+MAX_SENTENCE_CHARS = 20000
+
+TokenCounter = Callable[[List[str]], List[int]]
+
+
+def approximate_token_counts(texts: List[str]) -> List[int]:
+    """Приближенное число токенов: слова и знаки препинания"""
+    return [len(TOKEN_PATTERN.findall(text)) for text in texts]
+
+
+def tokenizer_token_counts(tokenizer) -> TokenCounter:
+    """Подсчет токенов токенизатором transformers (без служебных токенов)"""
+    def count(texts: List[str]) -> List[int]:
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+    return count
+
+
+def _is_abbreviation(sentence: str) -> bool:
+    """Оканчивается ли фрагмент с точкой на конце сокращением или инициалом, а не концом предложения"""
+    # Слово перед точкой ищется с конца, не дальше длины самого длинного сокращения
+    end = len(sentence) - 1
+    start = end
+    while start > 0 and end - start <= ABBREVIATION_MAX_CHARS and \
+            (sentence[start - 1].isalnum() or sentence[start - 1] == '_'):
+        start -= 1
+    word = sentence[start:end]
+    if not word or len(word) > ABBREVIATION_MAX_CHARS:
+        return False
+    return word.lower() in ABBREVIATIONS or (len(word) == 1 and word.isupper())
+
+
+def split_sentences(pieces: Union[str, Iterable[str]]) -> Iterator[str]:
+    """Предложения потока текста по мере поступления частей
+
+    Каждая часть вместе с концом незаконченного хвоста предыдущей режется
+    одним вызовом re.split; в цикле на Python остаются только проверка
+    сокращений и склейка фрагментов, разрезанных по ним.
+    """
+    if isinstance(pieces, str):
+        pieces = (pieces,)
+
+    tail = ''
+    for piece in pieces:
+        buffer = tail + piece
+        # Граница занимает несколько символов: режем с небольшим запасом до стыка с новой частью,
+        # уже просмотренное начало хвоста повторно не сканируется
+        position = max(0, len(tail) - 8)
+        # Тройки: текст, знаки конца (None для пустой строки между абзацами), пробелы
+        parts = SENTENCE_END.split(buffer[position:])
+        parts[0] = buffer[:position] + parts[0]
+        pending = ''
+        for i in range(0, len(parts) - 1, 3):
+            punctuation = parts[i + 1]
+            sentence = pending + parts[i] + (punctuation or '')
+            if punctuation == '.' and _is_abbreviation(sentence):
+                pending = sentence + parts[i + 2]
+                continue
+            pending = ''
+            sentence = sentence.strip()
+            if sentence:
+                yield sentence
+
+        tail = pending + parts[-1]
+        if len(tail) > MAX_SENTENCE_CHARS:
+            cut = tail.rfind(' ', 0, MAX_SENTENCE_CHARS) + 1 or MAX_SENTENCE_CHARS
+            yield tail[:cut].strip()
+            tail = tail[cut:]
+
+    tail = tail.strip()
+    if tail:
+        yield tail
+
+
+class TextChunker:
+    """Разбиение текста на чанки с перекрытием
+
+    Размер чанка - сумма токенов его предложений, посчитанных по отдельности
+    (для BPE токенизаторов токенизация склеенного чанка может отличаться на
+    несколько токенов на стыках).
+    """
+
+    def __init__(self, chunk_tokens: int, overlap_tokens: int = 0,
+                 count_tokens: TokenCounter = approximate_token_counts):
+        if not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("Перекрытие должно быть меньше размера чанка")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = count_tokens
+
+    def chunks(self, text: Union[str, Iterable[str]]) -> Iterator[str]:
+        """Чанки текста (строки или итератора частей) по мере разбиения"""
+        window: deque = deque()
+        window_tokens = 0
+        # Есть ли в окне предложения, еще не вошедшие ни в один чанк
+        fresh = False
+
+        for sentence, tokens in self._counted(split_sentences(text)):
+            if window_tokens + tokens > self.chunk_tokens:
+                if fresh:
+                    yield ' '.join(s for s, _ in window)
+                    fresh = False
+                    # Следующий чанк начинается с хвоста текущего в пределах перекрытия
+                    while window and window_tokens > self.overlap_tokens:
+                        window_tokens -= window.popleft()[1]
+                while window and window_tokens + tokens > self.chunk_tokens:
+                    window_tokens -= window.popleft()[1]
+
+            window.append((sentence, tokens))
+            window_tokens += tokens
+            fresh = True
+
+        if fresh:
+            yield ' '.join(s for s, _ in window)
+
+    def _counted(self, sentences: Iterator[str]) -> Iterator[Tuple[str, int]]:
+        """Предложения с числом токенов; слишком длинные разбиваются по словам"""
+        batch = []
+        for sentence in sentences:
+            batch.append(sentence)
+            if len(batch) >= COUNT_BATCH:
+                yield from self._count_batch(batch)
+                batch = []
+        if batch:
+            yield from self._count_batch(batch)
+
+    def _count_batch(self, sentences: List[str]) -> Iterator[Tuple[str, int]]:
+        for sentence, tokens in zip(sentences, self.count_tokens(sentences)):
+            if tokens <= self.chunk_tokens:
+                yield sentence, tokens
+            else:
+                yield from self._split_long(sentence, tokens)
+
+    def _split_long(self, sentence: str, tokens: int) -> Iterator[Tuple[str, int]]:
+        """Части предложения по словам, каждая не длиннее chunk_tokens"""
+        words = WHITESPACE.split(sentence)
+        if len(words) == 1:
+            # Одно слово длиннее чанка (base64, URL) - режется по символам
+            step = max(1, len(sentence) * self.chunk_tokens // tokens)
+            parts = [sentence[i:i + step] for i in range(0, len(sentence), step)]
+        else:
+            step = max(1, len(words) * self.chunk_tokens // tokens)
+            parts = [' '.join(words[i:i + step]) for i in range(0, len(words), step)]
+
+        for part, count in zip(parts, self.count_tokens(parts)):
+            if count <= self.chunk_tokens or len(part) <= 1:
+                yield part, count
+            else:
+                yield from self._split_long(part, count)
@@ -0,0 +1,912 @@
+"""
+Векторное хранилище базы знаний с журнальным (append-only) сохранением
+
+Формат директории хранилища:
+    manifest.json        - размерность эмбеддингов и описание базового снимка
+    base_index_<N>.bin   - базовый снимок FAISS индекса по первым N строкам журнала
+    vectors.f32          - журнал всех векторов (float32, построчно)
+    tombstones.i64       - журнал ID удаленных векторов (int64)
+    chunks_*             - тексты и метаданные чанков (см. models.chunk_store)
+    bm25_index.pkl       - снимок инвертированного индекса для ключевого поиска
+
+Каждое добавление дописывает в конец журналов только новые векторы и записи,
+поэтому стоимость сохранения зависит от размера изменения, а не от размера базы.
+Компактизация периодически в фоне сохраняет текущий индекс как базовый снимок;
+при загрузке снимок дополняется векторами из хвоста журнала. Манифест
+переключается на новый снимок одной атомарной заменой файла.
+
+ID вектора совпадает с номером строки журнала. Удаление дописывает ID в
+журнал удалений; поиск исключает удаленные ID селектором FAISS, а
+компактизация убирает их из нового индекса (remove_ids). Индексы, которые
+не поддерживают удаление (HNSW), держат удаленные векторы до перестройки,
+она запускается в фоне, когда их доля растет.
+
+Поиск не берет блокировок и не ждет записи: он работает с опубликованным
+снимком состояния (_Snapshot), индекс которого после публикации не
+изменяется. Добавление и удаление под блокировкой записи дописывают
+журналы и публикуют новый снимок заменой одной ссылки; строки, еще не
+вошедшие в индекс, ищутся точным перебором по журналу. Компактизация и
+перестройка собирают новый индекс по снимку без блокировки записи и
+подменяют индекс в текущем снимке.
+
+Тип индекса выбирается по размеру базы: точный перебор (Flat) для небольших
+баз, IVF или HNSW после порогов из config. Новый индекс обучается в фоне на
+векторах из журнала и подменяет текущий в снимке.
+
+Векторы в индексе могут храниться квантованными (SQ8 или PQ). Тогда поиск
+берет с запасом кандидатов из индекса и пересчитывает их точное сходство по
+исходным векторам из журнала, отображенного в память.
+"""
+
+import os
+import json
+import math
+import pickle
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import logging
+
+import numpy as np
+import faiss
+
+import config
+from models.chunk_store import ChunkStore
+from models.bm25_index import BM25Index
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_FORMAT = 3
+BASE_INDEX_FILE = 'base_index_{rows}.bin'
+VECTORS_FILE = 'vectors.f32'
+TOMBSTONES_FILE = 'tombstones.i64'
+KEYWORD_INDEX_FILE = 'bm25_index.pkl'
+
+# Снимок индекса без ID (формат 2), при загрузке индекс строится из журнала
+UNMAPPED_BASE_INDEX_FILE = 'base_index.bin'
+
+# Журнал записей чанков в JSON (заменен хранилищем ChunkStore)
+JSONL_CHUNKS_FILE = 'chunks.jsonl'
+
+# Файлы прежнего формата (полная перезапись при каждом сохранении)
+LEGACY_INDEX_FILE = 'faiss_index.bin'
+LEGACY_DOCUMENT_STORE_FILE = 'document_store.pkl'
+LEGACY_MAPPING_FILE = 'index_mapping.pkl'
+
+# Типы индекса
+INDEX_FLAT = 'flat'
+INDEX_IVF = 'ivf'
+INDEX_HNSW = 'hnsw'
+
+# Квантование векторов в индексе
+QUANTIZATION_NONE = 'none'
+QUANTIZATION_SQ8 = 'sq8'
+QUANTIZATION_PQ = 'pq'
+
+# Минимум векторов для обучения квантователя (PQ: 256 центроидов x 39 точек)
+QUANTIZATION_MIN_ROWS = {
+    QUANTIZATION_NONE: 0,
+    QUANTIZATION_SQ8: 1000,
+    QUANTIZATION_PQ: 256 * 39
+}
+
+# Размер пакета при заполнении индекса из журнала
+REBUILD_BATCH_ROWS = 65536
+
+# Размерности, для которых уже предупредили о замене PQ на SQ8
+_PQ_UNAVAILABLE_DIMS = set()
+
+
+def select_index_type(rows: int) -> str:
+    """Выбор типа индекса по числу векторов"""
+    if config.HNSW_INDEX_THRESHOLD and rows >= config.HNSW_INDEX_THRESHOLD:
+        return INDEX_HNSW
+    if config.IVF_INDEX_THRESHOLD and rows >= config.IVF_INDEX_THRESHOLD:
+        return INDEX_IVF
+    return INDEX_FLAT
+
+
+def pq_subquantizers(dim: int) -> int:
+    """Число подквантователей PQ: наибольший делитель размерности, не больше PQ_SUBQUANTIZERS"""
+    limit = max(1, min(config.PQ_SUBQUANTIZERS, dim))
+    return next(m for m in range(limit, 0, -1) if dim % m == 0)
+
+
+def select_quantization(rows: int, requested: str, dim: Optional[int] = None) -> str:
+    """Квантование, которое можно обучить на текущем числе векторов данной размерности"""
+    if requested not in QUANTIZATION_MIN_ROWS:
+        logging.warning(f"Неизвестный тип квантования: {requested}")
+        return QUANTIZATION_NONE
+    if requested == QUANTIZATION_PQ and dim is not None and pq_subquantizers(dim) == 1:
+        # Простая размерность делится только на 1: такой PQ бесполезен, берем SQ8
+        if dim not in _PQ_UNAVAILABLE_DIMS:
+            _PQ_UNAVAILABLE_DIMS.add(dim)
+            logging.warning(f"PQ невозможен для размерности {dim}, используется sq8")
+        requested = QUANTIZATION_SQ8
+    return requested if rows >= QUANTIZATION_MIN_ROWS[requested] else QUANTIZATION_NONE
+
+
+def _unwrap(index):
+    """Индекс без обертки IDMap"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def quantization_of(index) -> str:
+    """Определение квантования существующего индекса"""
+    index = _unwrap(index)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer, faiss.IndexHNSWSQ)):
+        return QUANTIZATION_SQ8
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ, faiss.IndexHNSWPQ)):
+        return QUANTIZATION_PQ
+    return QUANTIZATION_NONE
+
+
+def index_type_of(index) -> str:
+    """Определение типа существующего индекса"""
+    if faiss.try_extract_index_ivf(index) is not None:
+        return INDEX_IVF
+    if isinstance(_unwrap(index), faiss.IndexHNSW):
+        return INDEX_HNSW
+    return INDEX_FLAT
+
+
+def remove_from_index(index, ids: np.ndarray) -> bool:
+    """Удаление векторов из индекса; False, если индекс не поддерживает удаление"""
+    if index_type_of(index) == INDEX_HNSW:
+        return False
+    index.remove_ids(faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype='int64')))
+    return True
+
+
+class _Snapshot:
+    """Согласованное состояние хранилища для поиска
+
+    После публикации снимок не изменяется: писатели собирают новый снимок и
+    подменяют ссылку на него, поэтому поиск, взявший ссылку один раз, видит
+    индекс, число строк и удаления из одного и того же момента.
+    """
+
+    __slots__ = ('index', 'index_type', 'quantization', 'index_rows', 'index_tombstones', 'index_dead',
+                 'rows', 'deleted', 'dead', 'selector', '_selector_ids')
+
+    def __init__(self, index=None, index_type: str = INDEX_FLAT, quantization: str = QUANTIZATION_NONE,
+                 index_rows: int = 0, index_tombstones: int = 0, index_dead: int = 0, rows: int = 0,
+                 deleted: Optional[np.ndarray] = None, dead: int = 0):
+        # Индекс по строкам журнала [0, index_rows); строки дальше ищутся перебором по журналу
+        self.index = index
+        self.index_type = index_type
+        self.quantization = quantization
+        self.index_rows = index_rows
+        # Сколько записей журнала удалений и удаленных векторов было учтено при построении индекса
+        self.index_tombstones = index_tombstones
+        self.index_dead = index_dead
+        self.rows = rows
+        self.deleted = deleted if deleted is not None else np.empty(0, dtype='int64')
+        # Удаленные векторы, физически оставшиеся в индексе
+        self.dead = dead
+        # Селектор, исключающий удаленные ID из поиска по индексу (None, если удалений нет)
+        self.selector = None
+        self._selector_ids = None
+
+    def replace(self, **changes) -> '_Snapshot':
+        """Копия снимка с изменениями"""
+        snapshot = _Snapshot.__new__(_Snapshot)
+        for name in self.__slots__:
+            setattr(snapshot, name, changes.get(name, getattr(self, name)))
+        if 'deleted' in changes:
+            snapshot.selector = snapshot._selector_ids = None
+        return snapshot
+
+
+class VectorStore:
+    """FAISS индекс и записи чанков одной базы знаний
+
+    Поиск не берет блокировок: он читает текущий снимок (_Snapshot) и
+    неизменяемые префиксы журналов. Запись (добавление, удаление) идет под
+    блокировкой записи и только дописывает журналы, после чего публикует
+    новый снимок. Индекс опубликованного снимка не изменяется никогда:
+    новые векторы до компактизации ищутся точным перебором по журналу,
+    удаленные исключаются из поиска селектором ID, а компактизация и
+    перестройка собирают новый индекс в фоне и подменяют его в снимке.
+    """
+
+    def __init__(self, path: str, search_params: Optional[Dict[str, int]] = None,
+                 quantization: Optional[str] = None):
+        self.path = path
+        self.dim: Optional[int] = None
+        self.requested_quantization = quantization or config.VECTOR_QUANTIZATION
+        self._vectors = None
+        self.search_params = {
+            'nprobe': config.IVF_NPROBE,
+            'ef_search': config.HNSW_EF_SEARCH
+        }
+        self._snapshot = _Snapshot()
+
+        # Базовый снимок на диске: файл, покрытые строки журнала и записи журнала удалений
+        self.base_index_file: Optional[str] = None
+        self.base_rows = 0
+        self.base_tombstones = 0
+        self.base_dead = 0
+
+        # Блокировка записи журналов и публикации снимков; построение нового индекса
+        # (компактизация, перестройка) выполняется под отдельной блокировкой
+        self._write_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._rebuild_thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        os.makedirs(self.path, exist_ok=True)
+        self.chunks = ChunkStore(self.path)
+        self.keyword_index = BM25Index()
+        self._load()
+        self.set_search_params(**(search_params or {}))
+        self._maybe_schedule_rebuild()
+
+    @property
+    def index(self):
+        return self._snapshot.index
+
+    @property
+    def index_type(self) -> str:
+        return self._snapshot.index_type
+
+    @property
+    def quantization(self) -> str:
+        return self._snapshot.quantization
+
+    @property
+    def rows(self) -> int:
+        """Число строк журнала, видимых поиску (следующий ID)"""
+        return self._snapshot.rows
+
+    @property
+    def deleted(self) -> np.ndarray:
+        """Удаленные ID (отсортированы)"""
+        return self._snapshot.deleted
+
+    @property
+    def dead_in_index(self) -> int:
+        return self._snapshot.dead
+
+    @property
+    def ntotal(self) -> int:
+        """Число живых (не удаленных) векторов"""
+        snapshot = self._snapshot
+        return snapshot.rows - len(snapshot.deleted)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _publish(self, snapshot: _Snapshot):
+        """Подготовка селектора удаленных ID и публикация снимка одной заменой ссылки"""
+        if len(snapshot.deleted) and snapshot.selector is None:
+            # IDSelectorNot не владеет вложенным селектором, поэтому снимок хранит оба
+            snapshot._selector_ids = faiss.IDSelectorBatch(np.ascontiguousarray(snapshot.deleted, dtype='int64'))
+            snapshot.selector = faiss.IDSelectorNot(snapshot._selector_ids)
+        self._snapshot = snapshot
+
+    def _search_parameters(self, snapshot: _Snapshot):
+        """Параметры поиска по индексу снимка: nprobe/efSearch и исключение удаленных ID
+
+        Объект параметров создается на каждый поиск: FAISS падает, если один
+        объект используют одновременно несколько потоков.
+        """
+        if snapshot.index_type == INDEX_IVF:
+            params = faiss.SearchParametersIVF(nprobe=self.search_params['nprobe'])
+        elif snapshot.index_type == INDEX_HNSW:
+            params = faiss.SearchParametersHNSW(efSearch=self.search_params['ef_search'])
+        elif snapshot.selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+
+        if snapshot.selector is not None:
+            params.sel = snapshot.selector
+        return params
+
+    def _create_index(self, dim: int):
+        """Публикация пустого индекса"""
+        self.dim = dim
+        # Inner Product для косинусного сходства, ID = номер строки журнала
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        snapshot = self._snapshot
+        self._publish(_Snapshot(index, rows=snapshot.rows, deleted=snapshot.deleted, index_rows=snapshot.rows))
+
+    def _load(self):
+        """Загрузка базового снимка и воспроизведение хвоста журнала"""
+        if not os.path.exists(self._file(MANIFEST_FILE)):
+            if os.path.exists(self._file(LEGACY_INDEX_FILE)):
+                self._migrate_legacy()
+            return
+
+        with open(self._file(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.dim = dim = manifest['dim']
+
+        if os.path.exists(self._file(JSONL_CHUNKS_FILE)) and len(self.chunks) == 0:
+            self._migrate_jsonl_chunks()
+
+        vectors = self._read_vector_journal(dim)
+        rows = min(len(self.chunks), len(vectors))
+
+        # Обрезаем недописанный хвост журналов (например, после аварийного завершения)
+        self._truncate_journals(rows, dim)
+        tombstones = self._read_tombstones()
+
+        # Индекс еще не опубликован, поэтому его можно дополнять на месте
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        dead = 0
+        base_file = manifest.get('base_index') if manifest.get('format', 1) >= MANIFEST_FORMAT else None
+        if base_file and os.path.exists(self._file(base_file)):
+            if manifest['base_rows'] <= rows and manifest['base_tombstones'] <= len(tombstones):
+                index = faiss.read_index(self._file(base_file))
+                self.base_index_file = base_file
+                self.base_rows = manifest['base_rows']
+                self.base_tombstones = manifest['base_tombstones']
+                self.base_dead = dead = manifest['base_dead']
+            else:
+                logging.warning("Базовый снимок индекса новее журнала, индекс будет перестроен")
+        elif os.path.exists(self._file(UNMAPPED_BASE_INDEX_FILE)):
+            logging.info("Снимок индекса прежнего формата не используется, индекс строится из журнала")
+
+        deleted = np.unique(tombstones[tombstones < rows])
+        self._add_journal_rows(index, self._live_rows(self.base_rows, rows, deleted), vectors)
+
+        # Удаления после снимка, затронувшие векторы из снимка
+        removed = tombstones[self.base_tombstones:]
+        removed = removed[removed < self.base_rows]
+        if len(removed) and not remove_from_index(index, removed):
+            dead += len(removed)
+
+        self._publish(_Snapshot(
+            index, index_type_of(index), quantization_of(index),
+            index_rows=rows, index_tombstones=len(deleted), index_dead=dead,
+            rows=rows, deleted=deleted, dead=dead
+        ))
+
+        self._load_keyword_index(rows)
+        self.keyword_index.remove(deleted)
+
+        logging.info(
+            f"Загружено векторное хранилище: {self.ntotal} документов "
+            f"(индекс {self.index_type}/{self.quantization}, снимок {self.base_rows}, "
+            f"журнал {rows - self.base_rows}, удалено {len(deleted)})"
+        )
+
+    def _load_keyword_index(self, rows: int):
+        """Загрузка снимка ключевого индекса и индексация текстов из хвоста хранилища чанков"""
+        path = self._file(KEYWORD_INDEX_FILE)
+        if os.path.exists(path):
+            try:
+                keyword_index = BM25Index.load(path)
+                if len(keyword_index) <= rows:
+                    self.keyword_index = keyword_index
+                else:
+                    logging.warning("Снимок ключевого индекса новее журнала, индекс будет построен заново")
+            except Exception as e:
+                logging.error(f"Ошибка чтения снимка ключевого индекса: {e}")
+
+        start = len(self.keyword_index)
+        if rows > start:
+            self.keyword_index.add(self.chunks.get_text(row) for row in range(start, rows))
+
+    def _read_vector_journal(self, dim: int) -> np.ndarray:
+        """Отображение журнала векторов в память"""
+        path = self._file(VECTORS_FILE)
+        row_bytes = dim * 4
+        rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        if rows == 0:
+            return np.empty((0, dim), dtype='float32')
+        return np.memmap(path, dtype='float32', mode='r', shape=(rows, dim))
+
+    def _read_tombstones(self) -> np.ndarray:
+        """Журнал удалений в порядке записи"""
+        path = self._file(TOMBSTONES_FILE)
+        if not os.path.exists(path):
+            return np.empty(0, dtype='int64')
+
+        count = os.path.getsize(path) // 8
+        if os.path.getsize(path) > count * 8:
+            with open(path, 'r+b') as f:
+                f.truncate(count * 8)
+
+        return np.fromfile(path, dtype='<i8', count=count).astype('int64')
+
+    def _truncate_journals(self, rows: int, dim: int):
+        """Приведение журнала векторов и хранилища чанков к числу целых записей"""
+        path = self._file(VECTORS_FILE)
+        if os.path.exists(path) and os.path.getsize(path) > rows * dim * 4:
+            with open(path, 'r+b') as f:
+                f.truncate(rows * dim * 4)
+
+        if len(self.chunks) > rows:
+            self.chunks.truncate(rows)
+
+    @staticmethod
+    def _live_rows(start: int, end: int, deleted: np.ndarray) -> np.ndarray:
+        """Неудаленные ID в диапазоне строк журнала"""
+        return np.setdiff1d(np.arange(start, end, dtype='int64'), deleted, assume_unique=True)
+
+    def _add_journal_rows(self, index, ids: np.ndarray, vectors: np.ndarray):
+        """Добавление в индекс векторов журнала с заданными ID"""
+        for start in range(0, len(ids), REBUILD_BATCH_ROWS):
+            batch = ids[start:start + REBUILD_BATCH_ROWS]
+            index.add_with_ids(np.ascontiguousarray(vectors[batch]), batch)
+
+    def _migrate_jsonl_chunks(self):
+        """Перенос записей из JSON журнала в хранилище чанков"""
+        path = self._file(JSONL_CHUNKS_FILE)
+        records = []
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+
+        self.chunks.truncate(0)
+        self.chunks.append(records)
+        os.remove(path)
+        logging.info(f"Записи чанков перенесены в хранилище чанков: {len(records)}")
+
+    def _write_manifest(self):
+        """Атомарная запись манифеста"""
+        snapshot = self._snapshot
+        tmp_path = self._file(MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': MANIFEST_FORMAT,
+                'dim': self.dim,
+                'base_index': self.base_index_file,
+                'base_rows': self.base_rows,
+                'base_tombstones': self.base_tombstones,
+                'base_dead': self.base_dead,
+                'index_type': snapshot.index_type,
+                'quantization': snapshot.quantization
+            }, f)
+        os.replace(tmp_path, self._file(MANIFEST_FILE))
+
+    def _append_journals(self, embeddings: np.ndarray, records: List[Dict[str, Any]]):
+        """Дописывание новых векторов и записей в конец журналов"""
+        with open(self._file(VECTORS_FILE), 'ab') as f:
+            f.write(embeddings.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.chunks.append(records)
+
+    def _migrate_legacy(self):
+        """Перевод хранилища из формата с pickle файлами в журнальный формат"""
+        try:
+            legacy_index = faiss.read_index(self._file(LEGACY_INDEX_FILE))
+            with open(self._file(LEGACY_DOCUMENT_STORE_FILE), 'rb') as f:
+                document_store = pickle.load(f)
+            with open(self._file(LEGACY_MAPPING_FILE), 'rb') as f:
+                index_to_doc_mapping = pickle.load(f)
+
+            vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+            records = []
+            for idx in range(legacy_index.ntotal):
+                doc_data = document_store.get(index_to_doc_mapping.get(idx), {})
+                records.append({
+                    'text': doc_data.get('text', ''),
+                    'filename': doc_data.get('filename', 'Unknown'),
+                    'chunk_id': doc_data.get('chunk_id', 0),
+                    'timestamp': doc_data.get('timestamp')
+                })
+
+            self._create_index(legacy_index.d)
+            self._write_manifest()
+            self.add(np.ascontiguousarray(vectors, dtype='float32'), records)
+            logging.info(f"Векторное хранилище переведено в журнальный формат: {self.ntotal} документов")
+
+        except Exception as e:
+            logging.error(f"Ошибка миграции векторного хранилища: {e}")
+            self._snapshot = _Snapshot()
+            self.chunks.truncate(0)
+            self.keyword_index = BM25Index()
+
+    def add(self, embeddings: np.ndarray, records: List[Dict[str, Any]]) -> int:
+        """Добавление нормализованных эмбеддингов и записей чанков; возвращает первый ID"""
+        with self._write_lock:
+            first_id = self._snapshot.rows
+            self._publish(self._append_locked(embeddings, records))
+
+        self._maybe_schedule_compaction()
+        self._maybe_schedule_rebuild()
+        return first_id
+
+    def _append_locked(self, embeddings: np.ndarray, records: List[Dict[str, Any]]) -> _Snapshot:
+        """Дописывание журналов под блокировкой записи; возвращает снимок для публикации
+
+        Индекс текущего снимка не меняется: новые строки видны поиску через
+        перебор хвоста журнала до следующей компактизации.
+        """
+        if len(embeddings) != len(records):
+            raise ValueError("Число эмбеддингов не совпадает с числом записей")
+
+        if self._snapshot.index is None:
+            self._create_index(embeddings.shape[1])
+            self._write_manifest()
+
+        snapshot = self._snapshot
+        if len(records) == 0:
+            return snapshot
+
+        self._append_journals(embeddings, records)
+        self.keyword_index.add(record['text'] for record in records)
+        return snapshot.replace(rows=snapshot.rows + len(records))
+
+    def delete_document(self, filename: str) -> int:
+        """Удаление всех чанков документа; возвращает число удаленных векторов"""
+        with self._write_lock:
+            snapshot, removed = self._delete_locked(self.chunks.rows_of(filename), self._snapshot)
+            self._publish(snapshot)
+
+        self._maybe_schedule_compaction()
+        self._maybe_schedule_rebuild()
+        return removed
+
+    def replace_document(self, filename: str, embeddings: np.ndarray,
+                         records: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Замена чанков документа новыми; возвращает (добавлено, удалено)
+
+        Новые чанки и удаление старых публикуются одним снимком, поэтому
+        поиск видит либо прежнюю, либо новую версию документа целиком.
+        """
+        with self._write_lock:
+            old_rows = self.chunks.rows_of(filename)
+            snapshot, removed = self._delete_locked(old_rows, self._append_locked(embeddings, records))
+            self._publish(snapshot)
+
+        self._maybe_schedule_compaction()
+        self._maybe_schedule_rebuild()
+        return len(records), removed
+
+    def _delete_locked(self, ids: np.ndarray, snapshot: _Snapshot) -> Tuple[_Snapshot, int]:
+        """Запись удалений под блокировкой записи; возвращает снимок для публикации и число удаленных"""
+        ids = np.setdiff1d(np.asarray(ids, dtype='int64'), snapshot.deleted)
+        ids = ids[(ids >= 0) & (ids < snapshot.rows)]
+        if len(ids) == 0:
+            return snapshot, 0
+
+        with open(self._file(TOMBSTONES_FILE), 'ab') as f:
+            f.write(ids.astype('<i8').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.keyword_index.remove(ids)
+        # Векторы остаются в индексе снимка: поиск исключает их селектором ID
+        return snapshot.replace(
+            deleted=np.union1d(snapshot.deleted, ids),
+            dead=snapshot.dead + int(np.count_nonzero(ids < snapshot.index_rows))
+        ), len(ids)
+
+    def is_deleted(self, idx: int) -> bool:
+        """Удален ли вектор с данным ID"""
+        deleted = self._snapshot.deleted
+        position = np.searchsorted(deleted, idx)
+        return position < len(deleted) and deleted[position] == idx
+
+    def search(self, query_embeddings: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Поиск ближайших векторов по текущему снимку (без блокировок)"""
+        snapshot = self._snapshot
+        index = snapshot.index
+        results = []
+
+        if index is not None and index.ntotal:
+            params = self._search_parameters(snapshot)
+            fetch = min(top_k, index.ntotal)
+            if snapshot.quantization == QUANTIZATION_NONE:
+                results.append(index.search(query_embeddings, fetch, params=params))
+            else:
+                # Кандидаты из квантованного индекса с запасом и точный пересчет сходства
+                candidates = min(fetch * config.RESCORE_FACTOR, index.ntotal)
+                _, candidate_ids = index.search(query_embeddings, candidates, params=params)
+                results.append(self._rescore(query_embeddings, candidate_ids, fetch))
+
+        if snapshot.rows > snapshot.index_rows:
+            results.append(self._search_tail(snapshot, query_embeddings, top_k))
+
+        if not results:
+            empty = (len(query_embeddings), 0)
+            return np.empty(empty, dtype='float32'), np.empty(empty, dtype='int64')
+        if len(results) == 1:
+            return results[0]
+
+        # Объединение результатов индекса и хвоста журнала по сходству
+        scores = np.concatenate([scores for scores, _ in results], axis=1)
+        ids = np.concatenate([ids for _, ids in results], axis=1)
+        scores = np.where(ids >= 0, scores, -np.inf).astype('float32')
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def _search_tail(self, snapshot: _Snapshot, query_embeddings: np.ndarray,
+                     top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Точный перебор строк журнала, еще не вошедших в индекс"""
+        start, end = snapshot.index_rows, snapshot.rows
+        vectors = self._vector_journal(end)[start:end]
+        scores = query_embeddings @ vectors.T
+
+        deleted = snapshot.deleted
+        deleted = deleted[(deleted >= start) & (deleted < end)]
+        if len(deleted):
+            scores[:, deleted - start] = -np.inf
+
+        k = min(top_k, end - start)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top_scores = np.take_along_axis(top_scores, order, axis=1).astype('float32')
+        ids = np.take_along_axis(top, order, axis=1) + start
+        return top_scores, np.where(np.isfinite(top_scores), ids, -1).astype('int64')
+
+    def _rescore(self, query_embeddings: np.ndarray, candidate_ids: np.ndarray,
+                 top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Точное сходство кандидатов по исходным векторам из журнала"""
+        vectors = self._vector_journal(int(candidate_ids.max()) + 1)
+        scores = np.full((len(query_embeddings), top_k), -np.inf, dtype='float32')
+        indices = np.full((len(query_embeddings), top_k), -1, dtype='int64')
+
+        for row, (query, ids) in enumerate(zip(query_embeddings, candidate_ids)):
+            ids = ids[ids >= 0]
+            exact = vectors[ids] @ query
+            order = np.argsort(-exact)[:top_k]
+            scores[row, :len(order)] = exact[order]
+            indices[row, :len(order)] = ids[order]
+
+        return scores, indices
+
+    def _vector_journal(self, rows: int) -> np.ndarray:
+        """Журнал векторов, отображенный в память, не короче rows строк"""
+        vectors = self._vectors
+        if vectors is None or len(vectors) < rows:
+            vectors = self._read_vector_journal(self.dim)
+            self._vectors = vectors
+        return vectors
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Настройка баланса полноты и скорости поиска (nprobe для IVF, efSearch для HNSW)"""
+        if nprobe:
+            self.search_params['nprobe'] = int(nprobe)
+        if ef_search:
+            self.search_params['ef_search'] = int(ef_search)
+
+    def set_quantization(self, quantization: str):
+        """Выбор квантования векторов; индекс перестраивается в фоне, если его вид меняется"""
+        if quantization == self.requested_quantization:
+            return
+        self.requested_quantization = quantization
+        self._maybe_schedule_rebuild()
+
+    def get_vector_counts(self) -> Dict[str, int]:
+        """Число живых и удаленных векторов"""
+        snapshot = self._snapshot
+        return {
+            'live': snapshot.rows - len(snapshot.deleted),
+            'tombstoned': len(snapshot.deleted),
+            'in_index': snapshot.index.ntotal if snapshot.index is not None else 0,
+            'dead_in_index': snapshot.dead,
+            'unindexed': snapshot.rows - snapshot.index_rows
+        }
+
+    def get_index_info(self) -> Dict[str, Any]:
+        """Информация об индексе"""
+        snapshot = self._snapshot
+        return {
+            'index_type': snapshot.index_type,
+            'quantization': snapshot.quantization,
+            'requested_quantization': self.requested_quantization,
+            'vectors': snapshot.rows - len(snapshot.deleted),
+            **self.get_vector_counts(),
+            'keyword_index_rows': len(self.keyword_index),
+            'search_params': dict(self.search_params),
+            'rebuilding': self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+        }
+
+    def get_chunk(self, idx: int) -> Optional[Dict[str, Any]]:
+        """Запись чанка по ID вектора (текст читается с диска только для нее)"""
+        if self.is_deleted(idx):
+            return None
+        return self.chunks.get(idx)
+
+    def get_filenames(self) -> List[str]:
+        """Список документов, у которых остались неудаленные чанки"""
+        snapshot = self._snapshot
+        deleted = snapshot.deleted
+        if len(deleted) == 0:
+            return list(self.chunks.filenames)
+
+        files = self.chunks.meta['file'][:snapshot.rows]
+        live = np.ones(len(files), dtype=bool)
+        live[deleted[deleted < len(files)]] = False
+        return [self.chunks.filenames[i] for i in np.unique(files[live])]
+
+    def close(self):
+        """Остановка фоновой работы: новые компактизации и перестройки не запускаются,
+        текущие дожидаются завершения (после этого директорию хранилища можно удалять или переносить)"""
+        self._closed = True
+        for thread in (self._compaction_thread, self._rebuild_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+
+    def _maybe_schedule_compaction(self):
+        """Запуск фоновой компактизации, если изменений после построения индекса стало много"""
+        snapshot = self._snapshot
+        pending = (snapshot.rows - snapshot.index_rows) + (len(snapshot.deleted) - snapshot.index_tombstones)
+        if pending < config.VECTOR_STORE_COMPACTION_ROWS or self._closed:
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+
+        self._compaction_thread = threading.Thread(target=self.compact, name='vector-store-compaction')
+        self._compaction_thread.daemon = True
+        self._compaction_thread.start()
+
+    def compact(self):
+        """Перенос хвоста журнала и удалений в новый индекс и сохранение его базовым снимком"""
+        try:
+            with self._build_lock:
+                snapshot = self._snapshot
+                if snapshot.index is None:
+                    return
+                if snapshot.rows > snapshot.index_rows or len(snapshot.deleted) > snapshot.index_tombstones:
+                    self._merge(snapshot)
+                self._save_base_index()
+
+        except Exception as e:
+            logging.error(f"Ошибка компактизации векторного хранилища: {e}")
+
+    def _merge(self, snapshot: _Snapshot):
+        """Копия индекса снимка с векторами хвоста журнала и без удаленных векторов"""
+        index = faiss.clone_index(snapshot.index)
+        vectors = self._vector_journal(snapshot.rows)
+        self._add_journal_rows(index, self._live_rows(snapshot.index_rows, snapshot.rows, snapshot.deleted), vectors)
+
+        dead = snapshot.dead
+        removed = snapshot.deleted[snapshot.deleted < snapshot.index_rows]
+        if len(removed) and remove_from_index(index, removed):
+            dead = 0
+
+        self._publish_index(snapshot, index, snapshot.index_type, snapshot.quantization, dead)
+        logging.info(
+            f"Компактизация векторного хранилища: в индекс перенесено {snapshot.rows - snapshot.index_rows} строк"
+        )
+
+    def _publish_index(self, built_from: _Snapshot, index, index_type: str, quantization: str, dead: int):
+        """Подмена индекса в текущем снимке индексом, построенным по снимку built_from"""
+        with self._write_lock:
+            current = self._snapshot
+            # Удаления, сделанные во время построения, остаются в индексе до следующей компактизации
+            removed = np.setdiff1d(current.deleted, built_from.deleted, assume_unique=True)
+            self._publish(current.replace(
+                index=index,
+                index_type=index_type,
+                quantization=quantization,
+                index_rows=built_from.rows,
+                index_tombstones=len(built_from.deleted),
+                index_dead=dead,
+                dead=dead + int(np.count_nonzero(removed < built_from.rows))
+            ))
+
+    def _save_base_index(self):
+        """Сохранение индекса текущего снимка базовым снимком (под блокировкой построения)"""
+        snapshot = self._snapshot
+        if (snapshot.index_rows, snapshot.index_tombstones) == (self.base_rows, self.base_tombstones) \
+                and self.base_index_file is not None:
+            return
+
+        # Индекс опубликованного снимка не меняется, сериализация не держит блокировку записи
+        base_file = BASE_INDEX_FILE.format(rows=snapshot.index_rows)
+        tmp_path = self._file(base_file + '.tmp')
+        faiss.serialize_index(snapshot.index).tofile(tmp_path)
+        os.replace(tmp_path, self._file(base_file))
+
+        # Постинги удаленных чанков не попадают в снимок и не занимают память
+        self.keyword_index.purge()
+        tmp_path = self._file(KEYWORD_INDEX_FILE + '.tmp')
+        self.keyword_index.save(tmp_path)
+        os.replace(tmp_path, self._file(KEYWORD_INDEX_FILE))
+
+        with self._write_lock:
+            previous_file = self.base_index_file
+            self.base_index_file = base_file
+            self.base_rows = snapshot.index_rows
+            self.base_tombstones = snapshot.index_tombstones
+            self.base_dead = snapshot.index_dead
+            self._write_manifest()
+
+        # Прежние снимки больше не нужны: манифест уже указывает на новый
+        for name in (previous_file, UNMAPPED_BASE_INDEX_FILE):
+            if name and name != base_file and os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+
+        logging.info(
+            f"Базовый снимок векторного индекса: {snapshot.index_rows} строк, удалено {snapshot.index_tombstones}"
+        )
+
+    def _target_layout(self, rows: int) -> Tuple[str, str]:
+        """Тип индекса и квантование, подходящие для числа векторов"""
+        return select_index_type(rows), select_quantization(rows, self.requested_quantization, self.dim)
+
+    def _needs_rebuild(self) -> bool:
+        """База переросла тип индекса или в индексе накопилось много удаленных векторов"""
+        snapshot = self._snapshot
+        if self._target_layout(snapshot.rows - len(snapshot.deleted)) != (snapshot.index_type, snapshot.quantization):
+            return True
+        # Из остальных индексов удаленные векторы убирает компактизация
+        if snapshot.index_type != INDEX_HNSW:
+            return False
+        return snapshot.dead > 0 and snapshot.dead >= config.TOMBSTONE_REBUILD_RATIO * snapshot.index.ntotal
+
+    def _maybe_schedule_rebuild(self):
+        """Запуск фоновой перестройки индекса"""
+        if self._snapshot.index is None or self._closed or not self._needs_rebuild():
+            return
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+
+        self._rebuild_thread = threading.Thread(target=self.rebuild_index, name='vector-store-rebuild')
+        self._rebuild_thread.daemon = True
+        self._rebuild_thread.start()
+
+    def _factory_string(self, index_type: str, quantization: str, rows: int) -> str:
+        """Описание индекса для faiss.index_factory"""
+        codec = {
+            QUANTIZATION_NONE: 'Flat',
+            QUANTIZATION_SQ8: 'SQ8',
+            QUANTIZATION_PQ: f'PQ{pq_subquantizers(self.dim)}'
+        }[quantization]
+
+        if index_type == INDEX_IVF:
+            # Около 4*sqrt(N) списков, но не меньше 39 обучающих векторов на список.
+            # IVF хранит ID сам, остальным индексам нужна обертка IDMap
+            nlist = max(1, min(int(4 * math.sqrt(rows)), rows // 39))
+            return f"IVF{nlist},{codec}"
+        if index_type == INDEX_HNSW:
+            return f"IDMap,HNSW{config.HNSW_M}" + ('' if quantization == QUANTIZATION_NONE else f'_{codec}')
+        return f"IDMap,{codec}"
+
+    def rebuild_index(self):
+        """Построение индекса по живым векторам в фоне и атомарная подмена текущего
+
+        Если вид индекса уже совпадает с нужным, ничего не делается; если
+        нужный вид изменился во время построения (set_quantization), индекс
+        строится еще раз.
+        """
+        try:
+            rebuilt = False
+            while True:
+                with self._build_lock:
+                    snapshot = self._snapshot
+                    if snapshot.index is None or not self._needs_rebuild():
+                        break
+                    live = self._live_rows(0, snapshot.rows, snapshot.deleted)
+
+                    index_type, quantization = self._target_layout(len(live))
+                    factory = self._factory_string(index_type, quantization, len(live))
+                    logging.info(
+                        f"Перестройка векторного индекса: {snapshot.index_type}/{snapshot.quantization} -> {factory} "
+                        f"({len(live)} векторов, удалено {len(snapshot.deleted)})"
+                    )
+
+                    vectors = self._vector_journal(snapshot.rows)
+                    index = faiss.index_factory(self.dim, factory, faiss.METRIC_INNER_PRODUCT)
+
+                    if not index.is_trained:
+                        step = max(1, len(live) // config.ANN_TRAINING_SAMPLE)
+                        index.train(np.ascontiguousarray(vectors[live[::step]]))
+
+                    self._add_journal_rows(index, live, vectors)
+                    self._publish_index(snapshot, index, index_type, quantization, 0)
+                    rebuilt = True
+
+                logging.info(f"Векторный индекс перестроен: {factory}, {index.ntotal} векторов")
+
+            if rebuilt:
+                self.compact()
+
+        except Exception as e:
+            logging.error(f"Ошибка перестройки векторного индекса: {e}")
@@ -3,9 +3,10 @@ API маршруты для чат-бота
 """
 
 import os
+import json
 import uuid
 from datetime import datetime
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.utils import secure_filename
@@ -13,6 +14,8 @@ import logging
 
 import config
 from models.chatbot import ChatbotModel
+from models.model_registry import model_registry
+from models.cache import query_embedding_cache
 from models.data_processor import DocumentProcessor
 
 # Создание Blueprint
@@ -39,11 +42,34 @@ def get_document_processor():
         document_processor = DocumentProcessor()
     return document_processor
 
+def sse_event(event: str, data: dict) -> str:
+    """Форматирование события Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events):
+    """Потоковый ответ text/event-stream без буферизации на прокси"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 def allowed_file(filename):
     """Проверка разрешенных форматов файлов"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in config.ALLOWED_EXTENSIONS
 
+def parse_top_k(data):
+    """Число результатов поиска из запроса в пределах [1, MAX_SEARCH_RESULTS]; None, если значение некорректно"""
+    value = data.get('top_k', config.TOP_K_DOCUMENTS)
+    if isinstance(value, bool):
+        return None
+    try:
+        top_k = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return min(max(top_k, 1), config.MAX_SEARCH_RESULTS)
+
 @chatbot_bp.route('/status', methods=['GET'])
 def status():
     """Проверка статуса системы"""
@@ -55,9 +81,19 @@ def status():
             'status': 'running',
             'timestamp': datetime.now().isoformat(),
             'models_loaded': model.is_initialized(),
+            'models_state': model.get_loading_state(),
             'embedding_model': config.EMBEDDING_MODEL,
+            'embedding_backend': model_registry.get_embedding_backend(config.EMBEDDING_MODEL),
+            'embedding_parity': model_registry.get_embedding_parity(config.EMBEDDING_MODEL),
             'llm_model': config.LLM_MODEL,
+            'llm_backend': model_registry.get_llm_backend(config.LLM_MODEL),
             'vector_store_size': model.get_vector_store_size(),
+            'query_embedding_cache': query_embedding_cache.get_stats(),
+            'answer_cache': model.answer_cache.get_stats(),
+            'sessions': model.session_store.get_stats(),
+            'embedding_cache': model.embedding_cache.get_stats() if model.embedding_cache is not None else None,
+            'context': model.context_packer.get_stats() if model.context_packer is not None else None,
+            'reranker': model.reranker.get_stats() if model.reranker is not None else None,
             'supported_formats': list(config.ALLOWED_EXTENSIONS)
         }
         
@@ -113,6 +149,48 @@ def chat():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@chatbot_bp.route('/chat/stream', methods=['POST'])
+@limiter.limit(config.RATE_LIMIT_CHAT)
+def chat_stream():
+    """Чат с потоковой передачей токенов ответа (Server-Sent Events)
+    
+    События: token ({"text": ...}) по мере генерации и done
+    ({"response": ..., "session_id": ...}) с итоговым ответом.
+    """
+    data = request.get_json(silent=True)
+    
+    if not isinstance(data, dict) or 'message' not in data:
+        return jsonify({
+            'error': 'Сообщение обязательно',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    # Нестроковое сообщение отклоняется так же, как пустое
+    message = data['message'].strip() if isinstance(data['message'], str) else ''
+    session_id = data.get('session_id', str(uuid.uuid4()))
+    
+    if not message:
+        return jsonify({
+            'error': 'Сообщение не может быть пустым',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    model = get_chatbot_model()
+    logging.info(f"Chat stream request - Session: {session_id}, Message: {message[:50]}...")
+    
+    def events():
+        for item in model.generate_response_stream(message, session_id):
+            if item['event'] == 'token':
+                yield sse_event('token', {'text': item['text']})
+            else:
+                yield sse_event('done', {
+                    'response': item['response'],
+                    'session_id': session_id,
+                    'timestamp': datetime.now().isoformat()
+                })
+    
+    return sse_response(events())
+
 @chatbot_bp.route('/upload_document', methods=['POST'])
 @limiter.limit("5 per minute")
 def upload_document():
@@ -148,7 +226,7 @@ def upload_document():
             if result['success']:
                 # Обновление векторного хранилища
                 model = get_chatbot_model()
-                model.update_knowledge_base(result['text'], unique_filename)
+                ingestion_stats = model.update_knowledge_base(result['text'], unique_filename)
                 
                 logging.info(f"Документ загружен: {filename}")
                 
@@ -157,6 +235,9 @@ def upload_document():
                     'filename': filename,
                     'file_id': unique_filename,
                     'pages_processed': result.get('pages_processed', 1),
+                    'chunks_added': ingestion_stats['chunks_added'],
+                    'duplicates_dropped': ingestion_stats['duplicates_dropped'],
+                    'chunks_per_second': ingestion_stats['chunks_per_second'],
                     'timestamp': datetime.now().isoformat()
                 }), 200
             else:
@@ -182,14 +263,121 @@ def upload_document():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@chatbot_bp.route('/documents/<file_id>', methods=['DELETE'])
+@limiter.limit("10 per minute")
+def delete_document(file_id):
+    """Удаление документа из базы знаний"""
+    try:
+        model = get_chatbot_model()
+        chunks_removed = model.delete_document(file_id)
+        
+        if not chunks_removed:
+            return jsonify({
+                'error': 'Документ не найден',
+                'timestamp': datetime.now().isoformat()
+            }), 404
+        
+        # Удаление загруженного файла
+        filepath = os.path.join(config.UPLOAD_FOLDER, secure_filename(file_id))
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        
+        logging.info(f"Документ удален: {file_id}")
+        
+        return jsonify({
+            'message': 'Документ удален из базы знаний',
+            'file_id': file_id,
+            'chunks_removed': chunks_removed,
+            'timestamp': datetime.now().isoformat()
+        }), 200
+        
+    except Exception as e:
+        logging.error(f"Ошибка удаления документа: {e}")
+        return jsonify({
+            'error': 'Внутренняя ошибка сервера',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@chatbot_bp.route('/documents/<file_id>', methods=['PUT'])
+@limiter.limit("5 per minute")
+def replace_document(file_id):
+    """Замена документа новой версией с тем же file_id"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({
+                'error': 'Файл не найден в запросе',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        file = request.files['file']
+        
+        if secure_filename(file_id) != file_id or not allowed_file(file_id):
+            return jsonify({
+                'error': 'Некорректный идентификатор документа',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        if not allowed_file(file.filename) or \
+                file.filename.rsplit('.', 1)[1].lower() != file_id.rsplit('.', 1)[1].lower():
+            return jsonify({
+                'error': 'Формат новой версии должен совпадать с форматом документа',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        # Новая версия сохраняется рядом и заменяет файл только после успешной обработки
+        filepath = os.path.join(config.UPLOAD_FOLDER, file_id)
+        tmp_filepath = os.path.join(config.UPLOAD_FOLDER, f"{uuid.uuid4()}_{file_id}")
+        file.save(tmp_filepath)
+        
+        try:
+            processor = get_document_processor()
+            result = processor.process_document(tmp_filepath)
+            
+            if not result['success']:
+                return jsonify({
+                    'error': f'Ошибка обработки документа: {result["error"]}',
+                    'timestamp': datetime.now().isoformat()
+                }), 400
+            
+            model = get_chatbot_model()
+            ingestion_stats = model.replace_document(result['text'], file_id)
+            os.replace(tmp_filepath, filepath)
+        finally:
+            # Временный файл не должен оставаться при любой ошибке
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+        
+        logging.info(f"Документ заменен: {file_id}")
+        
+        return jsonify({
+            'message': 'Документ заменен новой версией',
+            'file_id': file_id,
+            'pages_processed': result.get('pages_processed', 1),
+            'chunks_added': ingestion_stats['chunks_added'],
+            'chunks_removed': ingestion_stats['chunks_removed'],
+            'duplicates_dropped': ingestion_stats['duplicates_dropped'],
+            'timestamp': datetime.now().isoformat()
+        }), 200
+        
+    except Exception as e:
+        logging.error(f"Ошибка замены документа: {e}")
+        return jsonify({
+            'error': 'Внутренняя ошибка сервера',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
 @chatbot_bp.route('/knowledge_base', methods=['GET'])
 def knowledge_base_info():
     """Информация о базе знаний"""
     try:
         model = get_chatbot_model()
         
+        vector_counts = model.vector_store.get_vector_counts()
+        
         info = {
             'vector_store_size': model.get_vector_store_size(),
+            'live_vectors': vector_counts['live'],
+            'tombstoned_vectors': vector_counts['tombstoned'],
             'total_documents': len(model.get_document_list()),
             'embedding_model': config.EMBEDDING_MODEL,
             'last_updated': model.get_last_update_time(),
@@ -219,7 +407,13 @@ def search_knowledge_base():
             }), 400
         
         query = data['query'].strip()
-        top_k = data.get('top_k', config.TOP_K_DOCUMENTS)
+        top_k = parse_top_k(data)
+        
+        if top_k is None:
+            return jsonify({
+                'error': 'Параметр top_k должен быть целым числом',
+                'timestamp': datetime.now().isoformat()
+            }), 400
         
         if not query:
             return jsonify({
@@ -245,6 +439,60 @@ def search_knowledge_base():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@chatbot_bp.route('/search/batch', methods=['POST'])
+@limiter.limit("10 per minute")
+def search_knowledge_base_batch():
+    """Пакетный поиск в базе знаний, результаты в порядке запросов"""
+    try:
+        data = request.get_json()
+        
+        if not data or not isinstance(data.get('queries'), list):
+            return jsonify({
+                'error': 'Список запросов обязателен',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        queries = [str(query).strip() for query in data['queries']]
+        top_k = parse_top_k(data)
+        
+        if top_k is None:
+            return jsonify({
+                'error': 'Параметр top_k должен быть целым числом',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        if not queries or not all(queries):
+            return jsonify({
+                'error': 'Запросы не могут быть пустыми',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        if len(queries) > config.SEARCH_BATCH_MAX_QUERIES:
+            return jsonify({
+                'error': f'Не более {config.SEARCH_BATCH_MAX_QUERIES} запросов за один вызов',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        # Поиск в базе знаний одним пакетом
+        model = get_chatbot_model()
+        results = model.search_many(queries, top_k)
+        
+        return jsonify({
+            'results': [
+                {'query': query, 'results': found, 'total_found': len(found)}
+                for query, found in zip(queries, results)
+            ],
+            'total_queries': len(queries),
+            'timestamp': datetime.now().isoformat()
+        }), 200
+        
+    except Exception as e:
+        logging.error(f"Ошибка пакетного поиска в базе знаний: {e}")
+        return jsonify({
+            'error': 'Внутренняя ошибка сервера',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
 @chatbot_bp.errorhandler(429)
 def ratelimit_handler(e):
     """Обработка превышения лимита запросов"""
@@ -14,6 +14,7 @@ import logging
 
 import config
 from models.project_manager import ProjectManager
+from routes.chatbot import sse_event, sse_response
 
 # Создание Blueprint
 projects_bp = Blueprint('projects', __name__)
@@ -263,6 +264,100 @@ def chat_with_project(project_id):
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@projects_bp.route('/projects/<project_id>/chat/stream', methods=['POST'])
+@limiter.limit("30 per minute")
+def chat_with_project_stream(project_id):
+    """Чат с проектным чат-ботом с потоковой передачей токенов (Server-Sent Events)"""
+    data = request.get_json(silent=True)
+    
+    if not isinstance(data, dict) or 'message' not in data:
+        return jsonify({
+            'status': 'error',
+            'message': 'Сообщение обязательно',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    # Нестроковое сообщение отклоняется так же, как пустое
+    message = data['message'].strip() if isinstance(data['message'], str) else ''
+    session_id = data.get('session_id', str(uuid.uuid4()))
+    
+    if not message:
+        return jsonify({
+            'status': 'error',
+            'message': 'Сообщение не может быть пустым',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    manager = get_project_manager()
+    if not manager.get_project_chatbot(project_id):
+        return jsonify({
+            'status': 'error',
+            'message': 'Чат-бот проекта не доступен',
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    logging.info(f"Chat stream project {project_id} - Session: {session_id}, Message: {message[:50]}...")
+    
+    def events():
+        for item in manager.chat_with_project_stream(project_id, message, session_id):
+            if item['event'] == 'token':
+                yield sse_event('token', {'text': item['text']})
+            else:
+                yield sse_event('done', {
+                    'status': 'success',
+                    'response': item['response'],
+                    'session_id': session_id,
+                    'timestamp': datetime.now().isoformat()
+                })
+    
+    return sse_response(events())
+
+@projects_bp.route('/projects/<project_id>/search-settings', methods=['PUT'])
+@limiter.limit("10 per minute")
+def update_search_settings(project_id):
+    """Настройка параметров поиска проекта (nprobe для IVF, ef_search для HNSW, quantization)"""
+    try:
+        data = request.get_json() or {}
+        
+        try:
+            nprobe = int(data['nprobe']) if data.get('nprobe') is not None else None
+            ef_search = int(data['ef_search']) if data.get('ef_search') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({
+                'status': 'error',
+                'message': 'nprobe и ef_search должны быть целыми числами',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        if (nprobe is not None and nprobe < 1) or (ef_search is not None and ef_search < 1):
+            return jsonify({
+                'status': 'error',
+                'message': 'nprobe и ef_search должны быть положительными',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        quantization = data.get('quantization')
+        if quantization is not None and quantization not in ('none', 'sq8', 'pq'):
+            return jsonify({
+                'status': 'error',
+                'message': 'quantization должно быть одним из: none, sq8, pq',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        manager = get_project_manager()
+        result = manager.update_search_params(project_id, nprobe, ef_search, quantization)
+        
+        result['timestamp'] = datetime.now().isoformat()
+        return jsonify(result), 200 if result['status'] == 'success' else 400
+        
+    except Exception as e:
+        logging.error(f"Ошибка настройки поиска проекта {project_id}: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
 @projects_bp.route('/projects/<project_id>/generate-code', methods=['POST'])
 @limiter.limit("10 per minute")
 def generate_integration_code(project_id):
@@ -333,7 +428,8 @@ def get_project_status(project_id):
             if chatbot:
                 status_info['model_info'] = {
                     'vector_store_size': chatbot.get_vector_store_size(),
-                    'documents_count': len(chatbot.get_document_list())
+                    'documents_count': len(chatbot.get_document_list()),
+                    'index': chatbot.vector_store.get_index_info()
                 }
         
         return jsonify({